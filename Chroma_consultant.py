@@ -1,64 +1,212 @@
-import pandas as pd
-import chromadb
-import ast
-
-def get_empathy_context(query_text):
-    # 하드코딩된 경로와 컬렉션 이름
-    csv_path = 'empathy_dialogue.csv'
-    db_path = 'your_database_directory1'
-    collection_name = 'my_collection'
-
-    # 1. CSV 파일을 pandas DataFrame으로 읽어오기
-    df = pd.read_csv(csv_path)
-
-    # 2. Chroma DB 인스턴스 생성
+import os
+import threading
+
+import numpy as np
+
+from dialogue_store import open_store
+from empathy_embedding import embed_texts
+from cache import LRUCache, normalize_text
+from lexical_index import build_child_indexes
+from metrics import metrics, span
+
+# 하드코딩된 경로와 컬렉션 이름
+CSV_PATH = 'empathy_dialogue.csv'
+DB_PATH = 'your_database_directory1'
+COLLECTION_NAME = 'my_collection'
+
+# 벡터 검색 백엔드 선택 ('chroma': ChromaDB, 'numpy': 내장 NumPy 색인)
+VECTOR_BACKEND = os.environ.get('EMPATHY_BACKEND', 'chroma')
+# NumPy 색인 디렉터리 (적재와 검색이 같은 임베딩 방식을 써야 하므로 방식마다 따로 둠)
+NUMPY_INDEX_DIR = os.environ.get('EMPATHY_INDEX_DIR', 'empathy_index')
+
+# 검색 대상 역할과 한 번에 가져올 결과 수
+CHILD_ROLE = '자녀'
+TOP_K = 5
+
+# 검색 방식 ('hybrid': n-gram 색인으로 후보를 추린 뒤 벡터로 재정렬, 'dense': 전체 벡터 검색)
+RETRIEVAL_MODE = os.environ.get('EMPATHY_RETRIEVAL', 'hybrid')
+# 벡터로 재정렬할 최대 후보 수와 최종 점수에서 벡터 유사도의 비중
+CANDIDATE_CAP = int(os.environ.get('EMPATHY_CANDIDATES', '200'))
+DENSE_WEIGHT = float(os.environ.get('EMPATHY_DENSE_WEIGHT', '0.7'))
+
+# 자녀 답변 끝의 감정 이모지 → CSV의 감정 분류(category). 분류별로 나눈 색인에서 먼저 찾음
+EMOTION_BY_EMOJI = {'😊': '기쁨', '😳': '당황', '😠': '분노', '😰': '불안', '😢': '상처', '😔': '슬픔'}
+EMOTION_ROUTING = os.environ.get('EMPATHY_EMOTION_ROUTING', '1') == '1'
+# 이모지 뒤에 붙어도 무시하는 문자 (공백, 문장부호, 이모지 변형 선택자)
+_TRAILING_CHARS = set(' \t\n.,!?~\ufe0f')
+
+# 질의 임베딩과 검색 결과 캐시 크기 (항목 수)
+EMBEDDING_CACHE_SIZE = 2048
+RESULT_CACHE_SIZE = 1024
+
+# 벡터 DB에 메타데이터로 저장하는 컬럼 (적재는 ingest_empathy.py)
+METADATA_COLUMNS = ['role', 'id', 'category', 'speaker_emotion']
+
+
+def open_collection(db_path=DB_PATH, collection_name=COLLECTION_NAME, backend=None):
+    backend = backend or VECTOR_BACKEND
+    if backend == 'numpy':
+        from numpy_index import NumpyVectorIndex
+        return NumpyVectorIndex(NUMPY_INDEX_DIR)
+
+    # chromadb는 버전 충돌이 있을 수 있어 실제로 사용할 때만 불러옴
+    import chromadb
     client = chromadb.PersistentClient(path=db_path)  # provide a path to persist your database
+    return client.get_collection(collection_name)
+
+
+def route_emotion(text):
+    # 답변 끝(공백, 문장부호 제외)의 감정 이모지로 감정 분류를 고름. 없으면 None (전체 색인 사용)
+    for char in reversed(str(text)):
+        if char in _TRAILING_CHARS:
+            continue
+        return EMOTION_BY_EMOJI.get(char)
+    return None
+
+
+class EmpathyRetriever:
+    # 프로세스당 한 번만 생성되어 클라이언트, 컬렉션, 말뭉치를 메모리에 유지합니다.
+    def __init__(self, csv_path=CSV_PATH, db_path=DB_PATH, collection_name=COLLECTION_NAME):
+        # 1. 대화 id로 색인된 대화 저장소 열기 (CSV는 저장소가 오래됐을 때만 다시 파싱)
+        self.store = open_store(csv_path)
+
+        # 2. 설정된 백엔드의 컬렉션 열기 (둘 다 같은 query() 형식을 제공)
+        self.collection = open_collection(db_path, collection_name)
+
+        # 컬렉션 질의는 동시에 들어올 수 있으므로 잠금으로 보호
+        self._query_lock = threading.Lock()
+
+        # 3. 자녀 발화의 글자 n-gram 역색인 (하이브리드 검색의 후보 추리기, 전체 + 감정 분류별)
+        self.lexical_indexes = build_child_indexes(self.store, CHILD_ROLE) if RETRIEVAL_MODE == 'hybrid' else None
+
+        # 같은(정규화 기준) 자녀 발화는 임베딩과 검색을 다시 하지 않음
+        self.embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE)
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE)
+
+    def embed_query(self, query_text):
+        key = normalize_text(query_text)
+        return self.embedding_cache.get_or_compute(key, lambda: self._embed(key))
+
+    def _embed(self, text):
+        with span('retrieval_embed'):
+            return embed_texts([text])[0]
+
+    def query(self, query_text, k=TOP_K):
+        key = (normalize_text(query_text), k)
+        with span('retrieval'):
+            return self.result_cache.get_or_compute(key, lambda: self._query(query_text, k))
+
+    def _dense_scores(self, query_embedding, doc_ids):
+        # 후보 문서들의 코사인 유사도 (NumPy 색인은 직접, Chroma는 저장된 임베딩을 가져와 계산)
+        with self._query_lock:
+            if hasattr(self.collection, 'score_ids'):
+                return self.collection.score_ids(query_embedding, doc_ids)
+            result = self.collection.get(ids=doc_ids, include=['embeddings'])
+        if not result['ids']:
+            return [], []
+        vectors = np.asarray(result['embeddings'], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        return list(result['ids']), (vectors @ query).tolist()
+
+    def hybrid_search(self, query_text, query_embedding, k, category=None, cap=CANDIDATE_CAP):
+        # 어휘 점수로 상위 cap개만 추린 뒤 그 후보만 벡터로 점수를 매기고 두 점수를 합쳐 정렬
+        lexical_index = self.lexical_indexes.get(category)
+        if lexical_index is None:
+            return None
+        with span('retrieval_lexical'):
+            shortlist = lexical_index.shortlist(query_text, cap)
+        if len(shortlist) < k:
+            return None
+
+        lexical = dict(shortlist)
+        top_lexical = shortlist[0][1]
+        with span('retrieval_rerank'):
+            doc_ids, dense = self._dense_scores(query_embedding, [doc_id for doc_id, _ in shortlist])
+        fused = [(DENSE_WEIGHT * score + (1 - DENSE_WEIGHT) * lexical[doc_id] / top_lexical, doc_id)
+                 for doc_id, score in zip(doc_ids, dense)]
+        if not fused:
+            return None
+        fused.sort(reverse=True)
+        return [doc_id for _, doc_id in fused[:k]]
+
+    def _search(self, query_text, query_embedding, k, category):
+        # category가 있으면 그 감정 분류의 발화만 대상으로 검색하고, 가장 가까운 대화 id를 돌려줌
+        if self.lexical_indexes is not None:
+            doc_ids = self.hybrid_search(query_text, query_embedding, k, category)
+            if doc_ids:
+                # 문서 id는 '{대화 id}_{턴 번호}'
+                return doc_ids[0].rsplit('_', 1)[0]
+
+        # 겹치는 n-gram이 없으면 자녀 발화 전체(또는 분류 전체)에서 상위 k개만 검색 (필터링은 벡터 DB에서 수행)
+        where = {'role': CHILD_ROLE}
+        if category is not None:
+            where = {'$and': [{'role': CHILD_ROLE}, {'category': category}]}
+        with span('retrieval_search'), self._query_lock:
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=k,
+                where=where,
+                include=['metadatas', 'distances']
+            )
+
+        metadatas = results['metadatas'][0]
+        if not metadatas:
+            return None
+
+        # 거리가 가장 가까운 결과의 메타데이터를 그대로 사용
+        return metadatas[0]['id']
+
+    def _query(self, query_text, k):
+        query_embedding = self.embed_query(query_text)
+
+        # 감정 분류 색인에서 먼저 찾고, 분류를 알 수 없거나 결과가 없으면 전체 색인에서 찾음
+        category = route_emotion(query_text) if EMOTION_ROUTING else None
+        dialogue_id = None
+        for partition in ([category, None] if category else [None]):
+            dialogue_id = self._search(query_text, query_embedding, k, partition)
+            if dialogue_id is not None:
+                break
+
+        if dialogue_id is None:
+            return "No results found."
+
+        turns = self.store.turns(dialogue_id)
+
+        if not turns:
+            return "No matching text found in the CSV."
+
+        situation = '상황 부분은' + f"'{self.store.situation(dialogue_id)}'" + '이런 상황이야.'
+
+        context_text = ''.join(turn['role'] + ':' + turn['text'] + '\n' for turn in turns)
+
+        total_text = situation + context_text
+        return total_text
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever():
+    # 최초 호출 시에만 생성하고 이후에는 같은 인스턴스를 재사용
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = EmpathyRetriever()
+    return _retriever
 
-    # 컬렉션 생성 또는 선택
-    collection = client.get_collection(collection_name)
-
-    # Query ChromaDB for similar documents based on the query text
-    results = collection.query(
-        query_texts=[query_text],
-        n_results=5704  # 원하는 검색 결과의 수 (충분히 큰 수로 설정)
-    )
-
-    # 결과 정렬 (유사도 점수에 따라 높은 순서로)
-    sorted_results = sorted(zip(results['documents'][0], results['distances'][0], results['ids'][0], results['metadatas'][0]),
-                            key=lambda x: x[1], reverse=True)  # 거리 값으로 정렬 (높은 순서)
-
-    # 'role'이 '자녀'인 문서 필터링
-    filtered_results = []
-    for result in sorted_results:
-        document_dict = eval(result[0], {"nan": float('nan')})  # Define 'nan' as float('nan')
-        if document_dict.get('role') == '자녀':
-            filtered_results.append(result)
 
-    if not filtered_results:
-        return "No results found."
-
-    string = filtered_results[0][0]
-
-    # 'nan'을 None으로 변경
-    string = string.replace('nan', 'None')
-
-    # 문자열을 딕셔너리로 변환
-    data = ast.literal_eval(string)
-
-    df_text = df[df['id'] == data['id']]
-
-    if df_text.empty:
-        return "No matching text found in the CSV."
+def get_empathy_context(query_text):
+    return get_retriever().query(query_text)
 
-    situation = '상황 부분은' + f"'{df_text.iloc[0]['situation']}'" + '이런 상황이야.'
 
-    context_text = ''
-    for index in range(len(df_text)):
-        role = df_text.iloc[index]['role']
-        text = df_text.iloc[index]['text']
+def cache_stats():
+    retriever = get_retriever()
+    return {'embedding': retriever.embedding_cache.stats(), 'retrieval': retriever.result_cache.stats()}
 
-        row = role + ':'+ text + '\n'
-        context_text += row
 
-    total_text = situation + context_text
-    return total_text
\ No newline at end of file
+# 검색기가 아직 만들어지지 않았으면 메트릭 조회 때문에 새로 만들지 않음
+metrics.register_collector('retrieval_cache', lambda: cache_stats() if _retriever is not None else {})
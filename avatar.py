@@ -0,0 +1,113 @@
+import os
+import hashlib
+import threading
+
+# 원본 아바타 이미지와 크기별로 미리 만들어 둔 이미지를 저장할 디렉터리
+AVATAR_SOURCE_DIR = 'img'
+AVATAR_CACHE_DIR = os.environ.get('AVATAR_CACHE_DIR', 'avatar_cache')
+
+# 크기 이름별 한 변의 길이(px), 화면의 gr.Image에는 DISPLAY_SIZE를 사용
+AVATAR_SIZES = {'small': 128, 'medium': 384, 'large': 768}
+DISPLAY_SIZE = 'medium'
+WEBP_QUALITY = 80
+
+# 파일 이름에 내용 해시가 들어가므로 브라우저가 오래 캐시해도 됨
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def avatar_bucket(gender, age):
+    # 성별과 나이 구간(10세 기준)이 같으면 같은 이미지를 사용
+    prefix = 'boy' if gender == '남성' else 'girl'
+    suffix = '10_above' if float(age) >= 10 else '10_below'
+    return f"{prefix}_{suffix}"
+
+
+def _file_digest(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:12]
+
+
+class AvatarService:
+    # 원본 webp를 크기별로 한 번만 줄여 저장해 두고, 요청마다 다시 처리하지 않고 경로만 돌려줍니다.
+    def __init__(self, source_dir=AVATAR_SOURCE_DIR, cache_dir=AVATAR_CACHE_DIR, sizes=AVATAR_SIZES):
+        self.source_dir = source_dir
+        # 캐시 헤더 미들웨어가 URL의 절대 경로로 판별하므로 절대 경로로 보관
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.sizes = sizes
+        self.variants = {}
+        self.render_all()
+
+    def render_all(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in sorted(os.listdir(self.source_dir)):
+            if name.endswith('.webp'):
+                self._render(os.path.join(self.source_dir, name), name[:-len('.webp')])
+
+    def _render(self, source_path, bucket):
+        digest = _file_digest(source_path)
+        try:
+            # Pillow가 없으면 원본을 그대로 사용
+            from PIL import Image
+        except ImportError:
+            print("Pillow가 설치되어 있지 않아 원본 아바타 이미지를 사용합니다.")
+            for size_name in self.sizes:
+                self.variants[(bucket, size_name)] = source_path
+            return
+
+        image = None
+        for size_name, size in self.sizes.items():
+            path = os.path.join(self.cache_dir, f"{bucket}_{size_name}_{digest}.webp")
+            if not os.path.exists(path):
+                if image is None:
+                    image = Image.open(source_path)
+                    image.load()
+                variant = image.copy()
+                variant.thumbnail((size, size), Image.LANCZOS)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                variant.save(tmp_path, 'WEBP', quality=WEBP_QUALITY)
+                os.replace(tmp_path, path)
+            self.variants[(bucket, size_name)] = path
+
+    def path(self, gender, age, size=DISPLAY_SIZE):
+        bucket = avatar_bucket(gender, age)
+        return self.variants.get((bucket, size)) or os.path.join(self.source_dir, f"{bucket}.webp")
+
+
+class AvatarCacheMiddleware:
+    # 미리 만든 아바타 파일 응답에 장기 캐시 헤더를 붙이는 ASGI 미들웨어
+    def __init__(self, app, cache_dir=AVATAR_CACHE_DIR):
+        self.app = app
+        self.marker = os.path.abspath(cache_dir).replace(os.sep, '/')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self.marker not in scope.get('path', ''):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_headers(message):
+            if message['type'] == 'http.response.start' and message.get('status') == 200:
+                headers = [(key, value) for key, value in message.get('headers', []) if key.lower() != b'cache-control']
+                headers.append((b'cache-control', CACHE_CONTROL.encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_headers)
+
+
+def cache_header_middleware():
+    # Blocks.launch(app_kwargs={'middleware': [...]})에 넘길 미들웨어 설정
+    from starlette.middleware import Middleware
+    return Middleware(AvatarCacheMiddleware)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_avatar_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = AvatarService()
+    return _service
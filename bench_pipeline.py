@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import functools
+
+# 실제 API를 부르지 않도록 가짜 LLM 백엔드를 기본값으로 사용 (import 전에 설정해야 함)
+os.environ.setdefault('LLM_BACKEND', 'fake')
+os.environ.setdefault('PREFETCH_COUNSELOR', '0')
+os.environ.setdefault('COUNSELOR_CACHE_DIR', '')
+os.environ.setdefault('SESSION_DB', '')
+
+PARENT_UTTERANCES = [
+    "오늘 하루는 어땠어?",
+    "그랬구나, 그때 기분이 어땠니?",
+    "엄마(아빠)는 네 편이야. 더 얘기해 줄래?",
+    "힘들었겠다. 어떻게 하면 좋을지 같이 생각해 보자.",
+    "정말 잘했네! 자랑스러워.",
+]
+
+BENCH_PERSONA = {
+    'name': '민준',
+    'age': '5',
+    'gender': '남성',
+    'role': '아들',
+    'personality': '활발하고 호기심이 많은',
+    'hobbies': '축구와 레고',
+    'speaking_style': '밝고 솔직한 말투',
+    'parent_role': '엄마',
+}
+
+STAGES = ['persona_load', 'event_selection', 'prompt_build', 'retrieval', 'llm']
+
+
+class StageTimer:
+    # 함수를 감싸서 단계별 소요 시간과 턴별 프롬프트 토큰 수를 모읍니다.
+    def __init__(self, count_tokens):
+        self.count_tokens = count_tokens
+        self.turn = {}
+
+    def start_turn(self):
+        self.turn = {'stages': {}, 'prompt_tokens': 0}
+
+    def _add(self, stage, elapsed):
+        stages = self.turn.setdefault('stages', {})
+        stages[stage] = stages.get(stage, 0.0) + elapsed
+
+    def wrap(self, stage, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._add(stage, time.perf_counter() - started)
+        return wrapper
+
+    def wrap_stream(self, stage, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            first = True
+            try:
+                for item in fn(*args, **kwargs):
+                    if first:
+                        self.turn['first_token'] = time.perf_counter() - started
+                        first = False
+                    yield item
+            finally:
+                self._add(stage, time.perf_counter() - started)
+        return wrapper
+
+    def wrap_prompt(self, fn):
+        timed = self.wrap('prompt_build', fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            messages = timed(*args, **kwargs)
+            self.turn['prompt_tokens'] = sum(self.count_tokens(message.content) for message in messages)
+            return messages
+        return wrapper
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(turns):
+    summary = {}
+    for stage in STAGES + ['turn']:
+        values = [turn['total'] if stage == 'turn' else turn['stages'].get(stage, 0.0) for turn in turns]
+        values = [value * 1000 for value in values]
+        summary[stage] = {
+            'total_ms': sum(values),
+            'mean_ms': sum(values) / len(values) if values else 0.0,
+            'p50_ms': percentile(values, 0.5),
+            'p95_ms': percentile(values, 0.95),
+        }
+    tokens = [turn['prompt_tokens'] for turn in turns]
+    summary['prompt_tokens'] = {
+        'mean': sum(tokens) / len(tokens) if tokens else 0,
+        'max': max(tokens) if tokens else 0,
+        'last': tokens[-1] if tokens else 0,
+    }
+    return summary
+
+
+def run_display_session(timer, persona_file, max_turns, counselor):
+    import display_interface
+
+    session = display_interface.ChatSession(display_interface.load_persona_from_file(persona_file))
+    history = []
+    turns = []
+    for index in range(max_turns):
+        timer.start_turn()
+        started = time.perf_counter()
+        outputs = list(display_interface.chat_langchain(PARENT_UTTERANCES[index % len(PARENT_UTTERANCES)], history, session))
+        _, history, _, _, age, session = outputs[-1]
+        if counselor:
+            display_interface.evaluate_response(history, session)
+        timer.turn['total'] = time.perf_counter() - started
+        timer.turn['age'] = float(age)
+        turns.append(timer.turn)
+        if float(age) >= 20:
+            break
+    return turns
+
+
+def run_start_page_session(timer, max_turns):
+    import start_page
+
+    # 빈 상태로 시작해야 counseling_bot_chat이 페르소나 나이(5세)로 초기화함
+    # (counseling_bot_reset()의 기록은 나이 0으로 시작해서 20세까지 가지 않음)
+    start_page.get_memory().clear()
+    chat_history = {}
+    persona = dict(BENCH_PERSONA)
+    turns = []
+    for index in range(max_turns):
+        timer.start_turn()
+        started = time.perf_counter()
+        start_page.counseling_bot_chat(PARENT_UTTERANCES[index % len(PARENT_UTTERANCES)], persona, chat_history)
+        timer.turn['total'] = time.perf_counter() - started
+        timer.turn['age'] = float(chat_history['age'])
+        turns.append(timer.turn)
+        if chat_history['age'] >= 20:
+            break
+    return turns
+
+
+def install_timers(timer, counselor):
+    import display_interface
+    import start_page
+    from llm_client import get_llm_pool
+
+    pool = get_llm_pool()
+    pool.chat = timer.wrap('llm', pool.chat)
+    pool.stream = timer.wrap_stream('llm', pool.stream)
+
+    display_interface.load_persona_from_file = timer.wrap('persona_load', display_interface.load_persona_from_file)
+    display_interface.handle_event = timer.wrap('event_selection', display_interface.handle_event)
+    display_interface.child_prompt_engine.build = timer.wrap_prompt(display_interface.child_prompt_engine.build)
+    if counselor:
+        import Chroma_consultant
+        Chroma_consultant.get_empathy_context = timer.wrap('retrieval', Chroma_consultant.get_empathy_context)
+
+    start_page.get_common_event = timer.wrap('event_selection', start_page.get_common_event)
+    start_page.get_next_event = timer.wrap('event_selection', start_page.get_next_event)
+    start_page.prompt_engine.build = timer.wrap_prompt(start_page.prompt_engine.build)
+
+
+def format_report(results):
+    lines = []
+    for name, result in results.items():
+        lines.append(f"== {name}: {result['turns']}턴, 최종 나이 {result['final_age']} ==")
+        lines.append(f"{'단계':<16}{'합계(ms)':>12}{'평균(ms)':>12}{'p50(ms)':>12}{'p95(ms)':>12}")
+        for stage in STAGES + ['turn']:
+            row = result['summary'][stage]
+            lines.append(f"{stage:<16}{row['total_ms']:>12.1f}{row['mean_ms']:>12.2f}{row['p50_ms']:>12.2f}{row['p95_ms']:>12.2f}")
+        tokens = result['summary']['prompt_tokens']
+        lines.append(f"프롬프트 토큰: 평균 {tokens['mean']:.0f}, 최대 {tokens['max']}, 마지막 턴 {tokens['last']}")
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='가짜/기록 재생 LLM으로 5세~20세 대화 세션 전체의 단계별 소요 시간을 측정합니다.')
+    parser.add_argument('--sessions', type=int, default=1, help='경로별로 실행할 세션 수')
+    parser.add_argument('--max-turns', type=int, default=200, help='세션당 최대 턴 수')
+    parser.add_argument('--counselor', action='store_true', help='매 턴 상담사 평가(검색 포함)도 실행')
+    parser.add_argument('--turns-output', help='턴별 측정값을 JSONL로 저장할 경로')
+    parser.add_argument('--output', default='bench_output.txt', help='요약 보고서 경로')
+    parser.add_argument('--json', help='요약을 JSON으로 저장할 경로')
+    args = parser.parse_args()
+
+    from conversation_memory import count_tokens
+    timer = StageTimer(count_tokens)
+    install_timers(timer, args.counselor)
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    persona_file = os.path.join(workdir, 'persona.txt')
+    with open(persona_file, 'w', encoding='utf-8') as file:
+        file.write(''.join(f"{key}: {value}\n" for key, value in BENCH_PERSONA.items()))
+
+    runs = {'chat_langchain': [], 'counseling_bot_chat': []}
+    for _ in range(args.sessions):
+        runs['chat_langchain'].extend(run_display_session(timer, persona_file, args.max_turns, args.counselor))
+        runs['counseling_bot_chat'].extend(run_start_page_session(timer, args.max_turns))
+
+    results = {}
+    for name, turns in runs.items():
+        results[name] = {
+            'turns': len(turns),
+            'final_age': turns[-1]['age'] if turns else None,
+            'summary': summarize(turns),
+        }
+
+    if args.turns_output:
+        with open(args.turns_output, 'w', encoding='utf-8') as file:
+            for name, turns in runs.items():
+                for index, turn in enumerate(turns):
+                    file.write(json.dumps({'pipeline': name, 'turn': index, **turn}, ensure_ascii=False) + '\n')
+
+    report = format_report(results)
+    # 5세~20세 세션 전체를 측정했는지 확인 (--max-turns가 모자라면 실패)
+    incomplete = [name for name, result in results.items() if (result['final_age'] or 0) < 20]
+    with open(args.output, 'w', encoding='utf-8') as file:
+        file.write(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    print(report)
+    if incomplete:
+        print(f"20세까지 진행되지 않은 경로: {', '.join(incomplete)} (--max-turns를 늘려 주세요)")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
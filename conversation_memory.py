@@ -0,0 +1,126 @@
+import threading
+from collections import deque
+
+# 그대로 남겨 둘 최근 대화 수와 프롬프트 전체의 토큰 상한
+RECENT_TURNS = 6
+PROMPT_TOKEN_BUDGET = 3000
+# 단계별 요약 한 줄에 남길 글자 수와 단계 요약의 토큰 상한
+SUMMARY_LINE_CHARS = 40
+STAGE_SUMMARY_TOKENS = 300
+
+# 토크나이저는 처음 토큰을 셀 때 불러옴 (인코딩 파일을 읽는 데 시간이 걸림)
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding('o200k_base')
+                except Exception:  # tiktoken이 없거나 인코딩 파일을 받을 수 없는 환경
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # 한국어는 대략 글자 2개에 토큰 1개 정도로 어림
+    return max(1, len(text) // 2) if text else 0
+
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ''
+    encoding = get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[-max_tokens:])
+    return text[-max_tokens * 2:]
+
+
+def _clip(text, limit=SUMMARY_LINE_CHARS):
+    text = ' '.join(str(text).split())
+    return text if len(text) <= limit else text[:limit] + '…'
+
+
+def summarize_turn(user_input, response):
+    # 기본 요약기: 추가 LLM 호출 없이 발화 앞부분만 남김
+    return f"부모: {_clip(user_input)} / 자녀: {_clip(response)}"
+
+
+class StageSummary:
+    def __init__(self, stage):
+        self.stage = stage
+        self.lines = deque()
+        self.tokens = 0
+
+    def add(self, line, max_tokens):
+        self.lines.append(line)
+        self.tokens += count_tokens(line) + 1
+        # 단계 요약이 너무 길어지면 가장 오래된 줄부터 접음
+        while self.tokens > max_tokens and len(self.lines) > 1:
+            self.tokens -= count_tokens(self.lines.popleft()) + 1
+
+    def render(self):
+        return f"[{self.stage} 시기 요약]\n" + '\n'.join(self.lines)
+
+
+class RollingMemory:
+    # 최근 대화는 그대로, 오래된 대화는 나이 단계별 요약으로 접어서 토큰 상한 안에서 대화 기록을 만듭니다.
+    def __init__(self, recent_turns=RECENT_TURNS, stage_summary_tokens=STAGE_SUMMARY_TOKENS, summarizer=summarize_turn):
+        self.recent_turns = recent_turns
+        self.stage_summary_tokens = stage_summary_tokens
+        self.summarizer = summarizer
+        self.recent = deque()
+        self.summaries = {}
+        self.full_tokens = 0
+        self.last_report = None
+
+    def add_turn(self, user_input, response, stage):
+        line = f"부모: {user_input}\n자녀: {response}"
+        self.recent.append((user_input, response, stage, line, count_tokens(line)))
+        self.full_tokens += self.recent[-1][4]
+
+        # 오래된 대화는 해당 단계의 요약에 한 줄로만 반영 (이미 접힌 대화는 다시 처리하지 않음)
+        while len(self.recent) > self.recent_turns:
+            old_input, old_response, old_stage, _, _ = self.recent.popleft()
+            if old_stage not in self.summaries:
+                self.summaries[old_stage] = StageSummary(old_stage)
+            self.summaries[old_stage].add(self.summarizer(old_input, old_response), self.stage_summary_tokens)
+
+    def render(self, max_tokens):
+        recent = list(self.recent)
+        summaries = list(self.summaries.values())
+
+        def total():
+            return (sum(turn[4] + 1 for turn in recent)
+                    + sum(summary.tokens + count_tokens(summary.stage) + 8 for summary in summaries))
+
+        # 상한을 넘으면 오래된 단계 요약부터, 그다음 오래된 최근 대화부터 제외
+        while summaries and total() > max_tokens:
+            summaries.pop(0)
+        while len(recent) > 1 and total() > max_tokens:
+            recent.pop(0)
+
+        text = '\n'.join([summary.render() for summary in summaries] + [turn[3] for turn in recent])
+        if count_tokens(text) > max_tokens:
+            text = truncate_to_tokens(text, max_tokens)
+        return text
+
+    def build_report(self, prompt_tokens, history_tokens):
+        # 전체 기록을 그대로 넣었을 때와 비교해 이번 턴에서 줄인 토큰 수
+        self.last_report = {
+            'prompt_tokens': prompt_tokens,
+            'history_tokens': history_tokens,
+            'full_history_tokens': self.full_tokens,
+            'saved_tokens': max(0, self.full_tokens - history_tokens)
+        }
+        return self.last_report
@@ -0,0 +1,188 @@
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache, hash_key
+from llm_client import get_llm_pool
+from metrics import metrics, span, record_error
+
+REVIEW_MODEL = "gpt-4o"
+
+# 한 번의 LLM 요청으로 평가할 부모 발화 수와 동시에 보낼 요청 수
+REVIEW_BATCH_SIZE = 8
+REVIEW_WORKERS = 4
+# 평가 프롬프트에 넣을 공감 대화 예시의 글자 수
+EXAMPLE_CHARS = 300
+# 메모리에 보관할 턴별 평가 결과 수 (디스크 캐시가 없을 때도 같은 턴은 다시 평가하지 않음)
+MEMO_SIZE = 4096
+# 평가 기준을 바꾸면 올려서 이전 결과를 쓰지 않게 함
+REVIEW_VERSION = 1
+
+_executor = ThreadPoolExecutor(max_workers=REVIEW_WORKERS, thread_name_prefix='review')
+_JSON_ARRAY = re.compile(r'\[.*\]', re.S)
+
+
+def extract_turns(history):
+    # 화면의 대화 기록에서 (턴 번호, 직전 자녀 발화, 부모 발화, 이어진 자녀 발화) 목록을 만듦
+    turns = []
+    child_before = None
+    for user_input, response in history:
+        if user_input and user_input != 'system':
+            turns.append({
+                'turn': len(turns) + 1,
+                'child_before': child_before,
+                'parent': user_input,
+                'child_after': response,
+            })
+        if response:
+            child_before = response
+    return turns
+
+
+def turn_hash(turn):
+    # 위치와 관계없이 같은 대화 맥락의 같은 부모 발화는 같은 키
+    return hash_key('review', REVIEW_VERSION, REVIEW_MODEL, turn['child_before'], turn['parent'])
+
+
+def _clip(text, limit):
+    text = ' '.join(str(text).split())
+    return text if len(text) <= limit else text[:limit] + '…'
+
+
+def build_review_prompt(batch):
+    system = '''
+    당신은 상담사 육은영입니다. 부모가 자녀의 말에 얼마나 공감하며 대답했는지 평가합니다.
+    각 턴마다 직전 자녀 발화에 대한 부모 발화의 공감 정도를 1(전혀 공감하지 않음)~5(충분히 공감함)점으로 매기고,
+    참고 예시(공감형 대화셋에서 찾은 비슷한 대화)를 바탕으로 더 공감적으로 말하는 방법을 한 줄로 알려 주세요.
+    반드시 다음 형식의 JSON 배열로만 답하세요: [{"turn": 턴 번호, "score": 점수, "comment": "한 줄 피드백"}]
+    '''
+    blocks = []
+    for turn in batch:
+        blocks.append(
+            f"[턴 {turn['turn']}]\n"
+            f"자녀: {turn['child_before'] or '(대화 시작)'}\n"
+            f"부모: {turn['parent']}\n"
+            f"참고 예시: {_clip(turn['example'], EXAMPLE_CHARS) if turn['example'] else '없음'}"
+        )
+    return [{'role': 'system', 'content': system}, {'role': 'user', 'content': '\n\n'.join(blocks)}]
+
+
+def parse_review(text, batch):
+    # 응답에서 JSON 배열을 찾아 턴 번호별 {score, comment}로 (형식이 틀린 턴은 빠짐)
+    match = _JSON_ARRAY.search(text or '')
+    if match is None:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    numbers = {turn['turn'] for turn in batch}
+    reviews = {}
+    for item in items if isinstance(items, list) else []:
+        try:
+            number, score = int(item['turn']), int(item['score'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if number in numbers and 1 <= score <= 5:
+            reviews[number] = {'score': score, 'comment': str(item.get('comment', '')).strip()}
+    return reviews
+
+
+class ConversationReviewer:
+    # 대화 전체의 부모 발화를 공감 정도로 평가합니다.
+    # 턴별 결과는 (직전 자녀 발화, 부모 발화) 해시로 기억해 두고, 새로 생긴 턴만 몇 개씩 묶어 병렬로 요청합니다.
+    def __init__(self, retrieve=None, cache=None, batch_size=REVIEW_BATCH_SIZE):
+        # retrieve(자녀 발화) -> 공감 대화 예시 문자열, cache: get/put을 제공하는 디스크 캐시 (없으면 메모리만 사용)
+        self.retrieve = retrieve
+        self.cache = cache
+        self.batch_size = batch_size
+        self.memo = LRUCache(MEMO_SIZE)
+
+    def _cached(self, key):
+        review = self.memo.get(key)
+        if review is None and self.cache is not None:
+            review = self.cache.get(key)
+            if review is not None:
+                self.memo.put(key, review)
+        return review
+
+    def _store(self, key, review):
+        self.memo.put(key, review)
+        if self.cache is not None:
+            self.cache.put(key, review)
+
+    def _example(self, turn, session_id):
+        if self.retrieve is None or not turn['child_before']:
+            return None
+        try:
+            example = self.retrieve(turn['child_before'])
+        except Exception as e:
+            # 검색에 실패해도 예시 없이 평가는 계속함
+            record_error('review_retrieval', session_id, e)
+            return None
+        return example if example and not example.startswith('No ') else None
+
+    def _review_batch(self, batch, session_id):
+        for turn in batch:
+            turn['example'] = self._example(turn, session_id)
+        with span('counselor_review_batch', session_id, turns=len(batch)):
+            response = get_llm_pool().chat(build_review_prompt(batch), model=REVIEW_MODEL)
+        reviews = parse_review(response, batch)
+        for turn in batch:
+            review = reviews.get(turn['turn'])
+            if review is not None:
+                review['example'] = _clip(turn['example'], EXAMPLE_CHARS) if turn['example'] else None
+                # 형식이 맞게 평가된 턴만 기억 (다음 평가 때 다시 요청)
+                self._store(turn_hash(turn), review)
+        return reviews
+
+    def review(self, history, session_id=None):
+        turns = extract_turns(history)
+        results = []
+        # 같은 (직전 자녀 발화, 부모 발화) 턴은 한 번만 요청해서 같은 캐시 키를 동시에 쓰지 않게 함
+        pending = {}
+        for turn in turns:
+            key = turn_hash(turn)
+            review = self._cached(key)
+            if review is None:
+                pending.setdefault(key, turn)
+            results.append((turn, key, review))
+
+        with span('counselor_review', session_id, turns=len(turns), scored=len(pending)) as attributes:
+            unique = list(pending.values())
+            batches = [unique[i:i + self.batch_size] for i in range(0, len(unique), self.batch_size)]
+            futures = [_executor.submit(self._review_batch, batch, session_id) for batch in batches]
+            reviews = {}
+            failed = 0
+            for future in futures:
+                try:
+                    reviews.update(future.result())
+                except Exception as e:
+                    record_error('counselor_review', session_id, e)
+                    print(f"대화 평가 중 오류 발생: {e}")
+                    failed += 1
+            attributes['batches'] = len(batches)
+            attributes['failed_batches'] = failed
+        metrics.increment('review_turns', len(turns) - len(pending), result='memoized')
+        metrics.increment('review_turns', len(pending), result='requested')
+
+        scored = {key: reviews[turn['turn']] for key, turn in pending.items() if turn['turn'] in reviews}
+        return [{**turn, **(review or scored.get(key) or {'score': None, 'comment': '평가하지 못했습니다.'})}
+                for turn, key, review in results]
+
+
+def format_review(results):
+    if not results:
+        return "평가할 대화가 없습니다."
+    scores = [result['score'] for result in results if result['score'] is not None]
+    lines = []
+    if scores:
+        lines.append(f"공감 점수 평균 {sum(scores) / len(scores):.1f}/5 ({len(scores)}/{len(results)}턴 평가)")
+    for result in results:
+        score = f"{result['score']}/5" if result['score'] is not None else '-'
+        lines.append(f"[{result['turn']}턴 {score}] 부모: {_clip(result['parent'], 40)}")
+        if result['comment']:
+            lines.append(f"  → {result['comment']}")
+        if result.get('example'):
+            lines.append(f"  참고: {_clip(result['example'], 80)}")
+    return '\n'.join(lines)
@@ -0,0 +1,170 @@
+import os
+import csv
+import json
+import mmap
+import struct
+import tempfile
+
+# 원본 CSV와 전처리된 바이너리 파일 경로
+CSV_PATH = 'empathy_dialogue.csv'
+STORE_PATH = 'empathy_dialogue.bin'
+
+MAGIC = b'EMPD'
+VERSION = 1
+
+# 파일 머리: 매직, 버전, 헤더(JSON) 길이
+PREAMBLE = struct.Struct('<4sII')
+# 대화 한 건: 첫 발화 번호, 발화 수, 상황 텍스트 위치, 길이
+DIALOGUE_RECORD = struct.Struct('<IIII')
+# 발화 한 건: 역할, 감정 범주, 화자 감정 코드, 텍스트 위치, 길이
+TURN_RECORD = struct.Struct('<BBBxII')
+
+ENCODED_COLUMNS = ['role', 'category', 'speaker_emotion']
+
+
+def build_store(csv_path=CSV_PATH, store_path=STORE_PATH):
+    vocabs = {column: [''] for column in ENCODED_COLUMNS}
+    codes = {column: {'': 0} for column in ENCODED_COLUMNS}
+    dialogue_ids = []
+    dialogue_turns = {}
+    situations = {}
+
+    def encode(column, value):
+        table = codes[column]
+        if value not in table:
+            table[value] = len(vocabs[column])
+            vocabs[column].append(value)
+        return table[value]
+
+    # 1. CSV를 한 번만 읽어 대화 id별로 발화를 모으기 (같은 id는 원본 순서 유지)
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as file:
+        for row in csv.DictReader(file):
+            dialogue_id = row['id']
+            if dialogue_id not in dialogue_turns:
+                dialogue_ids.append(dialogue_id)
+                dialogue_turns[dialogue_id] = []
+                situations[dialogue_id] = row['situation']
+            dialogue_turns[dialogue_id].append((
+                encode('role', row['role']),
+                encode('category', row['category']),
+                encode('speaker_emotion', row['speaker_emotion']),
+                row['text']
+            ))
+
+    # 2. 텍스트는 하나의 연속된 바이트 블록으로 모으고 위치만 기록
+    text_blob = bytearray()
+
+    def pack_text(text):
+        data = text.encode('utf-8')
+        offset = len(text_blob)
+        text_blob.extend(data)
+        return offset, len(data)
+
+    dialogue_table = bytearray()
+    turn_table = bytearray()
+    turn_count = 0
+    for dialogue_id in dialogue_ids:
+        turns = dialogue_turns[dialogue_id]
+        situation_offset, situation_len = pack_text(situations[dialogue_id])
+        dialogue_table += DIALOGUE_RECORD.pack(turn_count, len(turns), situation_offset, situation_len)
+        for role, category, emotion, text in turns:
+            text_offset, text_len = pack_text(text)
+            turn_table += TURN_RECORD.pack(role, category, emotion, text_offset, text_len)
+        turn_count += len(turns)
+
+    header = json.dumps({
+        'vocabs': vocabs,
+        'ids': dialogue_ids,
+        'turn_count': turn_count,
+        'text_size': len(text_blob)
+    }, ensure_ascii=False).encode('utf-8')
+
+    # 3. 임시 파일에 쓴 뒤 교체해서 읽는 쪽이 반쯤 쓰인 파일을 보지 않도록 함
+    #    (여러 프로세스가 동시에 만들어도 서로의 임시 파일을 덮어쓰지 않도록 같은 디렉터리에 고유한 이름으로)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(store_path) + '.',
+                                    suffix='.tmp', dir=os.path.dirname(os.path.abspath(store_path)))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            file.write(header)
+            file.write(dialogue_table)
+            file.write(turn_table)
+            file.write(text_blob)
+        # mkstemp는 소유자만 읽을 수 있게 만들므로 일반 파일 권한으로 맞춤
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, store_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return store_path
+
+
+class DialogueStore:
+    # 대화 id로 정렬된 발화 목록을 O(1)로 돌려주는 메모리 매핑 저장소
+    def __init__(self, store_path=STORE_PATH):
+        self._file = open(store_path, 'rb')
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_len = PREAMBLE.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{store_path} 파일 형식이 올바르지 않습니다.")
+
+        header_start = PREAMBLE.size
+        header = json.loads(self._buffer[header_start:header_start + header_len].decode('utf-8'))
+        self.vocabs = header['vocabs']
+        self.ids = header['ids']
+        self._index = {dialogue_id: i for i, dialogue_id in enumerate(self.ids)}
+
+        self._dialogue_start = header_start + header_len
+        self._turn_start = self._dialogue_start + DIALOGUE_RECORD.size * len(self.ids)
+        self._text_start = self._turn_start + TURN_RECORD.size * header['turn_count']
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, dialogue_id):
+        return dialogue_id in self._index
+
+    def _text(self, offset, length):
+        start = self._text_start + offset
+        return self._buffer[start:start + length].decode('utf-8')
+
+    def situation(self, dialogue_id):
+        index = self._index.get(dialogue_id)
+        if index is None:
+            return None
+        _, _, offset, length = DIALOGUE_RECORD.unpack_from(self._buffer, self._dialogue_start + DIALOGUE_RECORD.size * index)
+        return self._text(offset, length)
+
+    def turns(self, dialogue_id):
+        index = self._index.get(dialogue_id)
+        if index is None:
+            return []
+
+        first_turn, count, _, _ = DIALOGUE_RECORD.unpack_from(self._buffer, self._dialogue_start + DIALOGUE_RECORD.size * index)
+        roles = self.vocabs['role']
+        categories = self.vocabs['category']
+        emotions = self.vocabs['speaker_emotion']
+
+        turns = []
+        for position in range(first_turn, first_turn + count):
+            role, category, emotion, offset, length = TURN_RECORD.unpack_from(self._buffer, self._turn_start + TURN_RECORD.size * position)
+            turns.append({
+                'role': roles[role],
+                'category': categories[category],
+                'speaker_emotion': emotions[emotion],
+                'text': self._text(offset, length)
+            })
+        return turns
+
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+
+def open_store(csv_path=CSV_PATH, store_path=STORE_PATH):
+    # 바이너리 파일이 없거나 CSV보다 오래됐을 때만 다시 생성
+    if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(csv_path):
+        build_store(csv_path, store_path)
+    return DialogueStore(store_path)
@@ -1,67 +1,118 @@
 from abc import ABC, abstractmethod
 import os
-import json
-import random
+import time
+import uuid
 import traceback
 import gradio as gr
-from langchain.llms import OpenAI
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain_core.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
 
-# 버전 충돌
-# import Chroma_consultant
-# from Chroma_consultant import get_empathy_context
+# 이 모듈은 chromadb를 불러오지 않음. EMPATHY_BACKEND=chroma이면 첫 상담사 평가 때 Chroma_consultant가 불러오며,
+# 버전 충돌 시 EMPATHY_BACKEND=numpy로 실행
+from cache import DiskCache, hash_key
+from event_catalog import EventScheduler, get_catalog, PUBERTY_EVENT
+from persona_store import persona_store
+from conversation_memory import RollingMemory, PROMPT_TOKEN_BUDGET, count_tokens
+from letter_digest import DigestBook
+from counselor_review import ConversationReviewer, format_review
+from prompt_engine import PromptEngine
+from prefetch import PrefetchExecutor
+from llm_client import get_llm_pool
+from metrics import metrics, span, record_error, observe_tokens, start_metrics_server
+from session_store import get_session_store
+from avatar import get_avatar_service, avatar_bucket, cache_header_middleware, AVATAR_CACHE_DIR
 
 # API 키 설정
 os.environ['OPENAI_API_KEY'] = 'your_api_key'
 
-# 언어 모델 인스턴스 생성
-llm = ChatOpenAI(
-    model_name="gpt-4o"
-)
-
-# 메모리 인스턴스 생성
-memory = ConversationBufferMemory(input_key="input", output_key="output")
+# 언어 모델 (호출은 모두 공유 LLM 클라이언트 풀을 통해 수행)
+CHILD_MODEL = "gpt-4o"
 
 # 채팅봇 설정
-conversation_count = 0
-event_conversation_count = 0
-current_event = None
-introduction_complete = False
-current_system_text = "당신의 자녀가 마주하게 될 이벤트가 준비중입니다."
-puberty_event_occurred = False
+INITIAL_SYSTEM_TEXT = "당신의 자녀가 마주하게 될 이벤트가 준비중입니다."
+
+# 한 프로세스에서 동시에 처리할 채팅 요청 수
+CONCURRENCY_LIMIT = int(os.environ.get('CHAT_CONCURRENCY', '32'))
+
+# 자녀 답변 직후 상담사 평가를 미리 계산할지 여부 (PREFETCH_COUNSELOR=0이면 버튼을 누를 때 계산)
+PREFETCH_COUNSELOR = os.environ.get('PREFETCH_COUNSELOR', '1') == '1'
+prefetcher = PrefetchExecutor()
+
+# 미리 만든 아바타 이미지는 Gradio 캐시로 복사하지 않고 그대로 제공
+gr.set_static_paths([AVATAR_CACHE_DIR])
+
+
+class ChatSession:
+    # 사용자(부모) 한 명의 대화 상태. gr.State로 세션마다 따로 보관합니다.
+    def __init__(self, persona, seed=None, session_id=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.persona = dict(persona)
+        # 나이별 이벤트 일정은 세션 시작 시 한 번만 정함 (seed로 재현 가능)
+        self.events = EventScheduler(get_catalog(), seed=seed, start_age=float(self.persona.get('age', 5)))
+        # langchain은 불러오는 데 오래 걸리므로 첫 세션을 만들 때 불러옴 (보통은 시작 후 미리 준비됨)
+        from langchain.memory import ConversationBufferMemory
+        self.memory = ConversationBufferMemory(input_key="input", output_key="output")
+        # 프롬프트에 넣을 대화 기록 (최근 대화 + 단계별 요약, 토큰 상한 적용)
+        self.rolling_memory = RollingMemory()
+        # 나이/단계별 대화 요약 (20세 편지는 이 요약만으로 작성)
+        self.digests = DigestBook(self.persona, self.session_id, on_digest=self.log_digest)
+        self.conversation_count = 0
+        self.event_conversation_count = 0
+        self.current_event = None
+        self.introduction_complete = False
+        self.current_system_text = INITIAL_SYSTEM_TEXT
+        self.puberty_event_occurred = False
+        # 마지막 자녀 답변과 그 턴 id (미리 계산한 결과를 찾을 때 사용)
+        self.last_turn_id = None
+        self.last_child_reply = None
+        # 화면에 마지막으로 보낸 아바타 구간 (바뀔 때만 이미지를 다시 보냄)
+        self.avatar_bucket = None
+        # 이어하기로 복원한 세션은 이미 저장소에 있음
+        self.stored = session_id is not None
+
+    def state(self):
+        # 기록마다 함께 저장하는 최신 상태 (이어하기 시 그대로 복원)
+        return {
+            'age': float(self.persona.get('age', 5)),
+            'conversation_count': self.conversation_count,
+            'event_conversation_count': self.event_conversation_count,
+            'introduction_complete': self.introduction_complete,
+            'current_event': self.current_event['name'] if self.current_event else None,
+            'current_system_text': self.current_system_text,
+            'puberty_event_occurred': self.puberty_event_occurred,
+        }
+
+    def log(self, kind, **payload):
+        # 턴, 이벤트, 나이 변화를 세션 저장소에 한 줄씩 추가 (SESSION_DB가 빈 값이면 저장하지 않음)
+        store = get_session_store()
+        if store is None:
+            return
+        try:
+            if not self.stored:
+                store.create(self.session_id, self.persona, self.events.seed)
+                self.stored = True
+            store.append(self.session_id, kind, payload, self.state())
+        except Exception as e:
+            print(f"세션 기록 저장 중 오류 발생: {e}")
+
+    def log_digest(self, level, key, text):
+        # 요약은 백그라운드에서 끝나므로 끝나는 대로 기록해 두고, 이어하기 시 다시 요약하지 않음
+        self.log('digest', level=level, key=key, text=text)
 
 
 class Chatbot(ABC):
     def __init__(self, model_name, persona_file):
-        self.llm = ChatOpenAI(model_name=model_name)
+        self.model_name = model_name
         self.persona = self.load_persona_from_file(persona_file)
         self.persona_file = persona_file
 
     def load_persona_from_file(self, persona_file):
-        persona = {}
-        try:
-            with open(persona_file, 'r', encoding='utf-8') as file:
-                for line in file:
-                    key, value = line.strip().split(': ', 1)
-                    if key == 'age' or key == 'conversation_count':
-                        persona[key] = int(value)
-                    else:
-                        persona[key] = value
-        except FileNotFoundError:
-            print(f"{persona_file} 파일을 찾을 수 없습니다.")
-        except Exception as e:
-            print(f"페르소나 로드 중 오류 발생: {e}")
+        persona = persona_store.load(persona_file)
+        for key in ('age', 'conversation_count'):
+            if key in persona:
+                persona[key] = int(float(persona[key]))
         return persona
 
     def save_persona_to_file(self):
-        try:
-            with open(self.persona_file, 'w', encoding='utf-8') as file:
-                for key, value in self.persona.items():
-                    file.write(f"{key}: {value}\n")
-        except Exception as e:
-            print(f"페르소나 저장 중 오류 발생: {e}")
+        persona_store.save(self.persona_file, self.persona)
 
     @abstractmethod
     def chat(self, user_input, history):
@@ -75,42 +126,25 @@ class Chatbot(ABC):
 class PromptChatbot(Chatbot):
     def __init__(self, model_name, persona_file):
         super().__init__(model_name, persona_file)
+        self.prompt_engine = PromptEngine(self.get_system_prompt)
 
-    def get_combined_prompt(self, user_input):
+    def get_system_prompt(self, persona, stage):
+        # 상담사 페르소나 파일이 없을 때도 평가할 수 있도록 기본값 사용
         systemmsg = f'''
-        당신은 상담사 육은영입니다. 당신의 성격은 {self.persona['personality']}입니다.
-        당신의 역할은 {self.persona['role']}로서 사용자의 메시지를 평가하는 것입니다.
+        당신은 상담사 육은영입니다. 당신의 성격은 {persona.get('personality', '따뜻하고 공감적인')}입니다.
+        당신의 역할은 {persona.get('role', '부모 상담사')}로서 사용자의 메시지를 평가하는 것입니다.
         '''
 
         purpose_prompt = f'''
         사용자로부터 받은 메시지를 평가하고, 해당 메시지에 대한 적절한 피드백을 제공합니다.
         '''
-
-        human_prompt = f'''
-        사용자 메시지: "{user_input}"
-        '''
-        return systemmsg + purpose_prompt + human_prompt
+        return systemmsg + purpose_prompt
 
     def chat(self, user_input, history):
         try:
-            combined_prompt = self.get_combined_prompt(user_input)
-            system_prompt = SystemMessagePromptTemplate.from_template(combined_prompt)
-            humanmsg = '{text}'
-            human_prompt = HumanMessagePromptTemplate.from_template(humanmsg)
-
-            chat_prompt = ChatPromptTemplate.from_messages([system_prompt, human_prompt])
-            prompt = chat_prompt.format_messages(
-                name=self.persona['name'],
-                age=self.persona['age'],
-                gender=self.persona['gender'],
-                role=self.persona['role'],
-                personality=self.persona['personality'],
-                hobbies=self.persona['hobbies'],
-                speaking_style=self.persona['speaking_style'],
-                text=user_input
-            )
+            prompt = self.prompt_engine.build(self.persona, None, user_input)
 
-            response = self.llm(messages=prompt).content
+            response = get_llm_pool().chat(prompt, model=self.model_name)
 
             history.append((user_input, response))
 
@@ -121,44 +155,18 @@ class PromptChatbot(Chatbot):
 
     def reset(self):
         persona = self.persona
-        gender = persona.get('gender', '여성')
-        age = int(persona.get('age', 0))
-
-        if gender == '남성':
-            if age >= 10:
-                image_path = r'img/boy_10_above.webp'
-            else:
-                image_path = r'img/boy_10_below.webp'
-        else:
-            if age >= 10:
-                image_path = r'img/girl_10_above.webp'
-            else:
-                image_path = r'img/girl_10_below.webp'
-
+        image_path = get_avatar_service().path(persona.get('gender', '여성'), int(persona.get('age', 0)))
         return [], image_path
 
 
-def load_persona_from_file():
-    persona = {}
-    try:
-        with open('shared_persona.txt', 'r', encoding='utf-8') as file:
-            for line in file:
-                key, value = line.strip().split(': ', 1)
-                persona[key] = value
-    except FileNotFoundError:
-        print("shared_persona.txt 파일을 찾을 수 없습니다.")
-    except Exception as e:
-        print(f"페르소나 로드 중 오류 발생: {e}")
-    return persona
+def load_persona_from_file(persona_file='shared_persona.txt'):
+    with span('persona_load'):
+        return persona_store.load(persona_file)
 
 
-def save_persona_to_file(persona):
-    try:
-        with open('shared_persona.txt', 'w', encoding='utf-8') as file:
-            for key, value in persona.items():
-                file.write(f"{key}: {value}\n")
-    except Exception as e:
-        print(f"페르소나 저장 중 오류 발생: {e}")
+def save_persona_to_file(persona, persona_file='shared_persona.txt'):
+    # 메모리에만 반영하고 파일 쓰기는 백그라운드에서 모아서 수행
+    persona_store.save(persona_file, persona)
 
 
 def get_stage_prompt(age):
@@ -174,10 +182,10 @@ def get_stage_prompt(age):
         return "성인"
 
 
-def get_combined_prompt(persona, history):
-    stage = get_stage_prompt(int(float(persona['age'])))  # float 변환 후 int로 변환
+def get_combined_prompt(persona, stage):
+    # 페르소나와 단계만으로 정해지는 고정 부분 (나이와 대화 기록은 get_turn_context에서 추가)
     systemmsg = f'''
-    당신은 {persona['name']}, {persona['age']}세, {persona['gender']}인 {persona['role']}입니다.
+    당신은 {persona['name']}, {persona['gender']}인 {persona['role']}입니다.
     당신은 {stage}입니다. 성격은 {persona['personality']}. 취미는 {persona['hobbies']}.
     말투는 {persona['speaking_style']}. 사용자(부모님)는 {persona['parent_role']}입니다.
     '''
@@ -208,8 +216,8 @@ def get_combined_prompt(persona, history):
     이벤트는 5번의 대화동안 유지되고, 새로운 이벤트로 최신화 됩니다. 상황이 변함에 따라 맞춰서 소통해주세요.
     '''
 
-    history_prompt = f'''
-    당신의 목표는 대화 기록({history})을 바탕으로 자연스럽게 대화를 이어 가는 것 입니다.
+    history_prompt = '''
+    당신의 목표는 아래에 주어지는 대화 기록을 바탕으로 자연스럽게 대화를 이어 가는 것 입니다.
     또한, 사용자(부모)와 대화를 하면서 발생되는 이벤트에 부모와 함께 소통하며 반응하고 성인이 되었을 때 대화를 종료합니다.
     그 후, 여태까지 사용자(부모)와 나누었던 모든 대화를 바탕으로 사용자(부모)가 어떤 부모였는지 편지를 작성해서 보여 주세요.
     편지에는 부모에게 감사했던 점이나 부족했던 점을 포함하여, 자녀의 입장에서 솔직하게 느낀 감정과 생각을 담아주세요.
@@ -218,179 +226,339 @@ def get_combined_prompt(persona, history):
     return systemmsg + purpose_prompt + situation_prompt + history_prompt
 
 
-def handle_event(age, history):
-    global conversation_count, event_conversation_count, current_event, current_system_text, puberty_event_occurred
-    if 11 <= age <= 14 and not puberty_event_occurred:
-        event = {
-            "name": "사춘기",
-            "description": "사춘기가 시작되었습니다. 감정의 변화가 많아집니다. 이 시기에는 감정의 기복이 심해지고, 부모와의 대화에서 반항적인 태도를 보일 가능성이 매우 높습니다. 하지만 이해와 공감을 통해 좋은 관계를 유지할 수 있습니다."
-        }
-        puberty_event_occurred = True
-    else:
-        event = get_common_event(age, history) or get_next_event(age, history)
-
-    if event:
-        current_event = event
-        stage = get_stage_prompt(age)
-        event_message = f"챕터: {event['name']}\n설명: {event['description']}"
-        current_system_text = event_message
-        memory.save_context({"input": "system"}, {"output": event_message})
-        event_conversation_count = 0
-    return age, history, current_system_text
-
-
-def get_common_event(age, history):
-    with open('events.json', 'r', encoding='utf-8') as file:
-        events = json.load(file)
-    for event in events['common_events']:
-        if event['age'] == age and event['name'] not in [h[0] for h in history]:
-            return event
-    return None
-
-
-def get_next_event(age, history):
-    with open('events.json', 'r', encoding='utf-8') as file:
-        events = json.load(file)
-    possible_events = [event for event in events['random_events'] if
-                       event['min_age'] <= age and event['name'] not in [h[0] for h in history]]
-    if not possible_events:
-        return None
-    return random.choice(possible_events)
-
-
-def increment_age_and_handle_event(persona, history):
+def get_turn_context(age, history):
+    return f"현재 당신의 나이는 {age}세입니다.\n대화 기록:\n{history}"
+
+
+child_prompt_engine = PromptEngine(get_combined_prompt)
+
+
+def handle_event(session, age, history):
+    with span('event_lookup', session.session_id, age=age):
+        event = session.events.event_for(age)
+        if event is PUBERTY_EVENT:
+            session.puberty_event_occurred = True
+
+        if event:
+            session.current_event = event
+            stage = get_stage_prompt(age)
+            event_message, _ = build_event_narration(event)
+            session.current_system_text = event_message
+            session.memory.save_context({"input": "system"}, {"output": event_message})
+            session.event_conversation_count = 0
+            session.digests.add_event(event['name'])
+            session.log('event', age=age, name=event['name'], text=event_message)
+    return age, history, session.current_system_text
+
+
+def build_event_narration(event):
+    # 이벤트 시작 시 보여줄 설명과, 5번 대화 후 보여줄 상세 설명/예시 질문
+    event_message = f"챕터: {event['name']}\n설명: {event['description']}"
+    details = event.get('details', '')
+    questions = event.get('questions', [])
+    details_message = f"상세 설명: {details}\n예시 질문: {', '.join(questions)}"
+    return event_message, details_message
+
+
+def prefetch_turn(session, kid_response):
+    # 이전 턴의 평가가 아직 시작되지 않았다면 더 이상 필요 없으므로 취소
+    if session.last_turn_id is not None:
+        prefetcher.cancel(('counselor', session.last_turn_id))
+
+    session.last_turn_id = f"{session.session_id}:{session.conversation_count}"
+    session.last_child_reply = kid_response
+    if PREFETCH_COUNSELOR:
+        prefetcher.submit(('counselor', session.last_turn_id), evaluate_kid_response, kid_response, session.session_id)
+
+
+def get_common_event(age, fired=()):
+    return get_catalog().common_event(age, fired)
+
+
+def get_next_event(age, fired=()):
+    return get_catalog().next_event(age, fired)
+
+
+def increment_age_and_handle_event(session, history):
+    persona = session.persona
     age = float(persona['age'])
+    # 지난 한 살 동안의 대화를 백그라운드에서 요약 (단계가 바뀌거나 20세가 되면 그 단계의 요약도)
+    next_stage = get_stage_prompt(age + 1) if age + 1 < 20 else None
+    session.digests.close_period(age, get_stage_prompt(age), next_stage)
     age += 1  # 나이를 증가시킴
-    age, history, current_system_text = handle_event(age, history)
+    # 세션의 페르소나(나이 포함)는 메모리와 세션 저장소에만 두고 파일로 쓰지 않음
     persona['age'] = str(age)
-    save_persona_to_file(persona)
+    # 이어하기 시 새 나이의 이벤트가 지난 시기로 들어가지 않도록 나이 변화를 이벤트보다 먼저 기록
+    session.log('age', age=age)
+    age, history, current_system_text = handle_event(session, age, history)
     return history, current_system_text, age
 
 
-def chat_langchain(user_input, history):
-    global conversation_count, event_conversation_count, current_event, introduction_complete, current_system_text
+def avatar_update(session):
+    # 성별/나이 구간이 바뀐 경우에만 이미지를 보내고, 그 외에는 화면의 이미지를 그대로 둠
+    persona = session.persona
+    bucket = avatar_bucket(persona.get('gender', '여성'), persona.get('age', 0))
+    if bucket == session.avatar_bucket:
+        return gr.update()
+    session.avatar_bucket = bucket
+    return gr.update(value=get_avatar_service().path(persona.get('gender', '여성'), persona.get('age', 0)))
+
+
+def chat_langchain(user_input, history, session, persona=None):
+    # persona: 이 세션에서 설정한 자녀 페르소나 (없으면 저장된 기본 페르소나)
+    if session is None:
+        session = ChatSession(persona or load_persona_from_file())
     try:
-        persona = load_persona_from_file()
+        persona = session.persona
         age = float(persona['age'])
 
-        gender = persona.get('gender', '여성')
-        if gender == '남성':
-            if age >= 10:
-                image_path = r'img/boy_10_above.webp'
-            else:
-                image_path = r'img/boy_10_below.webp'
-        else:
-            if age >= 10:
-                image_path = r'img/girl_10_above.webp'
-            else:
-                image_path = r'img/girl_10_below.webp'
-
-        if not introduction_complete:
-            introduction_complete = True
+        if not session.introduction_complete:
+            session.introduction_complete = True
             introduction_message = f"안녕하세요! 저는 {age}살 {persona['name']}입니다. 제 취미는 {persona['hobbies']}이고, 저는 {persona['personality']} 성격을 가지고 있어요. 만나서 반가워요😊"
-            memory.save_context({"input": user_input}, {"output": introduction_message})
+            session.memory.save_context({"input": user_input}, {"output": introduction_message})
+            session.rolling_memory.add_turn(user_input, introduction_message, get_stage_prompt(age))
+            session.digests.add_turn(user_input, introduction_message)
             history.append((user_input, introduction_message))
-            conversation_count += 1
-
-            return "", history, image_path, current_system_text, age
-
-        conversation_count += 1
-        event_conversation_count += 1
-
-        combined_prompt = get_combined_prompt(persona, history)
-        system_prompt = SystemMessagePromptTemplate.from_template(combined_prompt)
-        humanmsg = '{text}'
-        human_prompt = HumanMessagePromptTemplate.from_template(humanmsg)
-
-        chat_prompt = ChatPromptTemplate.from_messages([system_prompt, human_prompt])
-        prompt = chat_prompt.format_messages(
-            name=persona['name'],
-            age=age,
-            gender=persona['gender'],
-            role=persona['role'],
-            personality=persona['personality'],
-            hobbies=persona['hobbies'],
-            speaking_style=persona['speaking_style'],
-            parent_role=persona['parent_role'],
-            text=user_input
-        )
-
-        response = llm(messages=prompt).content
-
-        memory.save_context({"input": user_input}, {"output": response})
-
+            session.conversation_count += 1
+            session.log('turn', user=user_input, response=introduction_message, age=age)
+
+            yield "", history, avatar_update(session), session.current_system_text, age, session
+            return
+
+        session.conversation_count += 1
+        session.event_conversation_count += 1
+
+        # 고정 부분과 입력을 뺀 나머지 토큰만 대화 기록에 사용
+        with span('prompt_build', session.session_id) as attributes:
+            stage = get_stage_prompt(age)
+            static_prompt = child_prompt_engine.static_message(persona, stage).content
+            fixed_tokens = count_tokens(static_prompt) + count_tokens(get_turn_context(age, '')) + count_tokens(user_input)
+            history_text = session.rolling_memory.render(PROMPT_TOKEN_BUDGET - fixed_tokens)
+            report = session.rolling_memory.build_report(fixed_tokens + count_tokens(history_text), count_tokens(history_text))
+
+            prompt = child_prompt_engine.build(persona, stage, user_input, context=get_turn_context(age, history_text))
+            attributes['prompt_tokens'] = report['prompt_tokens']
+            # 전체 기록 대신 요약을 넣어서 줄인 토큰 수
+            attributes['saved_tokens'] = report['saved_tokens']
+        observe_tokens('prompt', report['prompt_tokens'])
+        observe_tokens('saved', report['saved_tokens'])
+
+        # 토큰이 도착하는 대로 화면에 먼저 보여주고, 기록 정리는 스트림이 끝난 뒤에 수행
+        response = ''
         history.append((user_input, response))
-
-        if conversation_count == 1 and current_event is None:
-            age, history, current_system_text = handle_event(age, history)
-            return "", history, image_path, current_system_text, age
-
-        if event_conversation_count >= 5:
-            if current_event:
-                details = current_event.get('details', '')
-                questions = current_event.get('questions', [])
-                details_message = f"상세 설명: {details}\n예시 질문: {', '.join(questions)}"
-                memory.save_context({"input": "system"}, {"output": details_message})
-                current_event = None
-
-        if conversation_count % 5 == 0 and not current_event:
-            history, current_system_text, age = increment_age_and_handle_event(persona, history)
+        yield "", history, avatar_update(session), session.current_system_text, age, session
+        with span('llm_stream', session.session_id, model=CHILD_MODEL) as attributes:
+            started = time.perf_counter()
+            for content in get_llm_pool().stream(prompt, model=CHILD_MODEL):
+                if not response:
+                    attributes['first_token_ms'] = round((time.perf_counter() - started) * 1000, 3)
+                    metrics.observe('llm_first_token_seconds', time.perf_counter() - started)
+                response += content
+                history[-1] = (user_input, response)
+                yield "", history, avatar_update(session), session.current_system_text, age, session
+            attributes['completion_tokens'] = count_tokens(response)
+        observe_tokens('completion', attributes['completion_tokens'])
+
+        session.memory.save_context({"input": user_input}, {"output": response})
+        session.rolling_memory.add_turn(user_input, response, get_stage_prompt(age))
+        session.digests.add_turn(user_input, response)
+        session.log('turn', user=user_input, response=response, age=age)
+        prefetch_turn(session, response)
+
+        if session.conversation_count == 1 and session.current_event is None:
+            age, history, session.current_system_text = handle_event(session, age, history)
+            yield "", history, avatar_update(session), session.current_system_text, age, session
+            return
+
+        if session.event_conversation_count >= 5:
+            if session.current_event:
+                event = session.current_event
+                _, details_message = build_event_narration(event)
+                session.memory.save_context({"input": "system"}, {"output": details_message})
+                session.current_event = None
+                session.log('system', text=details_message)
+
+        if session.conversation_count % 5 == 0 and not session.current_event:
+            history, session.current_system_text, age = increment_age_and_handle_event(session, history)
 
         if float(persona['age']) >= 20:
             completion_message = "아이의 나이가 20세가 되어 대화가 종료됩니다. 평가를 위해 평가 버튼을 눌러주십시오."
             history.append(("system", completion_message))
-            return completion_message, history, image_path, "", 20
-
-        return "", history, image_path, current_system_text, age
+            session.log('notice', text=completion_message)
+            yield completion_message, history, avatar_update(session), "", 20, session
+
+            # 편지는 전체 대화 대신 단계별 요약으로 작성하므로 대화 길이와 관계없이 걸리는 시간이 일정함
+            letter = ''
+            history.append((None, letter))
+            for content in session.digests.stream_letter():
+                letter += content
+                history[-1] = (None, letter)
+                yield completion_message, history, avatar_update(session), "", 20, session
+            session.log('letter', text=letter)
+            return
+
+        yield "", history, avatar_update(session), session.current_system_text, age, session
     except Exception as e:
+        record_error('chat_langchain', session.session_id, e)
         error_message = f"Error: {str(e)}\n{traceback.format_exc()}"
-        return error_message, history, error_message, "", age
-
-
-def counseling_bot_reset():
-    global conversation_count, event_conversation_count, current_event, introduction_complete, current_system_text, puberty_event_occurred
-    conversation_count = 0
-    event_conversation_count = 0
-    current_event = None
-    introduction_complete = False
-    current_system_text = "당신의 자녀가 마주하게 될 이벤트가 준비중입니다."
-    memory.clear()
-    persona = load_persona_from_file()
+        yield error_message, history, gr.update(), "", age, session
+
+
+def counseling_bot_reset(session, persona=None):
+    # 이 세션의 상태만 새로 만들고 다른 사용자의 세션에는 영향을 주지 않음
+    saved_session_id = gr.update()
+    if session is not None:
+        old_session_id = session.session_id
+        prefetcher.cancel_matching(lambda turn_id: str(turn_id[1]).startswith(old_session_id))
+        # 지금까지의 대화는 턴마다 저장되어 있으므로 저장 완료 표시만 하고, 이어하기용 id를 보여줌
+        store = get_session_store()
+        if store is not None and session.stored:
+            store.mark_saved(old_session_id)
+            saved_session_id = old_session_id
+    session = ChatSession(persona or load_persona_from_file())
+    persona = session.persona
     initial_age = float(persona['age']) if 'age' in persona else 5
-    puberty_event_occurred = False
-
-    gender = persona.get('gender', '여성')
-    if gender == '남성':
-        if initial_age >= 10:
-            image_path = r'img/boy_10_above.webp'
-        else:
-            image_path = r'img/boy_10_below.webp'
-    else:
-        if initial_age >= 10:
-            image_path = r'img/girl_10_above.webp'
-        else:
-            image_path = r'img/girl_10_below.webp'
 
-    return [], image_path, gr.update(interactive=True), current_system_text, initial_age
+    return [], avatar_update(session), gr.update(interactive=True), session.current_system_text, initial_age, session, saved_session_id
+
+
+def restore_session(session_id):
+    # 저장된 기록을 순서대로 다시 적용해서 대화 상태를 복원 (이벤트 일정은 같은 시드로 다시 만듦)
+    store = get_session_store()
+    data = store.load(session_id) if store is not None else None
+    if data is None:
+        return None, []
+
+    session = ChatSession(data['persona'], seed=data['seed'], session_id=session_id)
+    events_by_name = {event['name']: event for event in session.events.timeline.values()}
+    history = []
+    for entry in data['entries']:
+        kind = entry['kind']
+        if kind == 'turn':
+            session.memory.save_context({"input": entry['user']}, {"output": entry['response']})
+            session.rolling_memory.add_turn(entry['user'], entry['response'], get_stage_prompt(entry['age']))
+            session.digests.add_turn(entry['user'], entry['response'])
+            history.append((entry['user'], entry['response']))
+        elif kind in ('event', 'system'):
+            if kind == 'event':
+                session.events.event_for(entry['age'])
+                session.digests.add_event(entry['name'])
+            session.memory.save_context({"input": "system"}, {"output": entry['text']})
+        elif kind == 'notice':
+            history.append(("system", entry['text']))
+        elif kind == 'age':
+            # 요약은 다시 예약하지 않고, 기록된 요약이 없는 시기만 편지를 쓸 때 계산
+            closed_age = entry['age'] - 1
+            next_stage = get_stage_prompt(entry['age']) if entry['age'] < 20 else None
+            session.digests.close_period(closed_age, get_stage_prompt(closed_age), next_stage, schedule=False)
+        elif kind == 'digest':
+            session.digests.restore_digest(entry['level'], entry['key'], entry['text'])
+        elif kind == 'letter':
+            history.append((None, entry['text']))
+
+    state = data['state'] or {}
+    session.persona['age'] = str(state.get('age', session.persona.get('age', 5)))
+    session.conversation_count = state.get('conversation_count', 0)
+    session.event_conversation_count = state.get('event_conversation_count', 0)
+    session.introduction_complete = state.get('introduction_complete', bool(history))
+    session.current_event = events_by_name.get(state.get('current_event'))
+    session.current_system_text = state.get('current_system_text', INITIAL_SYSTEM_TEXT)
+    session.puberty_event_occurred = state.get('puberty_event_occurred', False)
+    return session, history
+
+
+def resume_session(session_id, session):
+    session_id = (session_id or '').strip()
+    try:
+        restored, history = restore_session(session_id)
+    except Exception as e:
+        error_message = f"Error: {str(e)}\n{traceback.format_exc()}"
+        return gr.update(), gr.update(), error_message, gr.update(), session
+    if restored is None:
+        return gr.update(), gr.update(), f"저장된 세션을 찾을 수 없습니다: {session_id}", gr.update(), session
+    if session is not None:
+        old_session_id = session.session_id
+        prefetcher.cancel_matching(lambda turn_id: str(turn_id[1]).startswith(old_session_id))
+    return history, avatar_update(restored), restored.current_system_text, float(restored.persona['age']), restored
 
 
 chatbot2 = PromptChatbot(model_name='gpt-4o', persona_file='shared_persona2.txt')
 
+# 상담사 응답 디스크 캐시 (COUNSELOR_CACHE_DIR를 빈 값으로 두면 사용하지 않음)
+counselor_cache_dir = os.environ.get('COUNSELOR_CACHE_DIR', 'counselor_cache')
+counselor_cache = DiskCache(counselor_cache_dir) if counselor_cache_dir else None
+
+# 캐시 적중률과 미리 계산 현황은 메트릭 조회 시점에 읽어 옴
+metrics.register_collector('prefetch', prefetcher.stats)
+if counselor_cache is not None:
+    metrics.register_collector('counselor_cache', counselor_cache.stats)
+
+
+def evaluate_kid_response(kid_response, session_id=None):
+    with span('counselor_eval', session_id):
+        return _evaluate_kid_response(kid_response, session_id)
+
+
+def _evaluate_kid_response(kid_response, session_id):
+    try:
+        # 검색 백엔드(chromadb/numpy)는 첫 평가 때 불러옴
+        from Chroma_consultant import get_empathy_context
+        empathy_response = get_empathy_context(kid_response)
+    except Exception as e:
+        record_error('get_empathy_context', session_id, e)
+        return f"Error: {str(e)}\n{traceback.format_exc()}"
+    command_prompt = f"'{kid_response}'는 자녀인 챗봇의 대화이고 '{empathy_response}' 자녀인 챗봇 대화내용을 바탕으로 벡터DB로 찾은 공감형대화셋에서 가장 유사도 높은 대화내역들이야 이걸 바탕으로 아빠가 어떻게 말해야 공감형 대화를 할 수 있는지에 대해 대화방식,대화예시로  총 3줄 요약으로 답해줘"
+
+    cache_key = hash_key(command_prompt, chatbot2.model_name)
+    if counselor_cache is not None:
+        cached = counselor_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-def evaluate_response(history1):
+    response, _ = chatbot2.chat(command_prompt, [])
+
+    # 오류 메시지는 캐시하지 않음
+    if counselor_cache is not None and not response.startswith("Error:"):
+        counselor_cache.put(cache_key, response)
+    return response
+
+
+def evaluate_response(history1, session=None):
     if history1:
         kid_response = history1[-1][1]
-        # 버전 충돌로 인한 제외
-        # empathy_response = get_empathy_context(kid_response)
-        #command_prompt = f"'{kid_response}'는 자녀인 챗봇의 대화이고 '{empathy_response}' 자녀인 챗봇 대화내용을 바탕으로 벡터DB로 찾은 공감형대화셋에서 가장 유사도 높은 대화내역들이야 이걸 바탕으로 아빠가 어떻게 말해야 공감형 대화를 할 수 있는지에 대해 대화방식,대화예시로  총 3줄 요약으로 답해줘"
+        # 마지막 자녀 답변이면 답변 직후 시작해 둔 평가 결과를 사용
+        if session is not None and session.last_child_reply == kid_response:
+            return prefetcher.get(('counselor', session.last_turn_id),
+                                  lambda: evaluate_kid_response(kid_response, session.session_id))
+        return evaluate_kid_response(kid_response, session.session_id if session is not None else None)
+    return "평가할 대화가 없습니다."
+
+
+def _review_example(kid_response):
+    from Chroma_consultant import get_empathy_context
+    return get_empathy_context(kid_response)
 
-        #response, _ = chatbot2.chat(command_prompt, [])
 
-        return response
-    return "버전 충돌로 인해 구현중입니다."
+# 대화 전체 평가 (턴별 결과는 상담사 디스크 캐시에 함께 보관)
+conversation_reviewer = ConversationReviewer(retrieve=_review_example, cache=counselor_cache)
+
+
+def review_conversation(history1, session=None):
+    # 마지막 답변만이 아니라 모든 부모 발화를 평가하고, 이전에 평가한 턴은 다시 요청하지 않음
+    try:
+        results = conversation_reviewer.review(history1 or [], session.session_id if session is not None else None)
+    except Exception as e:
+        record_error('review_conversation', session.session_id if session is not None else None, e)
+        return f"Error: {str(e)}\n{traceback.format_exc()}"
+    return format_review(results)
 
 
 with gr.Blocks(theme=gr.themes.Base()) as app2:
+    # 세션별 대화 상태 (첫 메시지에서 생성)
+    session_state = gr.State(None)
+    # 세션별 자녀 페르소나 (페르소나 설정 화면에서 전달, 다른 사용자와 공유하지 않음)
+    persona_state = gr.State(None)
+
     with gr.Tab("멋진 아빠 되기 프로젝트"):
         gr.Markdown(
             value="""
@@ -424,19 +592,7 @@ with gr.Blocks(theme=gr.themes.Base()) as app2:
                 )
             with gr.Column(scale=1):
                 persona = load_persona_from_file()
-                gender = persona.get('gender', '여성')
-                age = int(persona.get('age', 0))
-
-                if gender == '남성':
-                    if age >= 10:
-                        initial_image_path = r'img/boy_10_above.webp'
-                    else:
-                        initial_image_path = r'img/boy_10_below.webp'
-                else:
-                    if age >= 10:
-                        initial_image_path = r'img/girl_10_above.webp'
-                    else:
-                        initial_image_path = r'img/girl_10_below.webp'
+                initial_image_path = get_avatar_service().path(persona.get('gender', '여성'), int(persona.get('age', 0)))
 
                 sub_image = gr.Image(
                     label="당신의 자녀",
@@ -447,6 +603,11 @@ with gr.Blocks(theme=gr.themes.Base()) as app2:
                     label="상담사가가 당신을 바라보며 말합니다.",
                     interactive=False
                 )
+                review_text = gr.Textbox(
+                    label="대화 전체 평가",
+                    lines=6,
+                    interactive=False
+                )
 
         with gr.Row():
             cb_user_input = gr.Textbox(
@@ -467,26 +628,52 @@ with gr.Blocks(theme=gr.themes.Base()) as app2:
                 variant="primary"
             ).click(
                 fn=evaluate_response,
-                inputs=[cb_chatbot],
+                inputs=[cb_chatbot, session_state],
                 outputs=[sub_text]
             )
+            gr.Button(
+                value="대화 전체 평가",
+                scale=1
+            ).click(
+                fn=review_conversation,
+                inputs=[cb_chatbot, session_state],
+                outputs=[review_text]
+            )
+
+        with gr.Row():
+            session_id_box = gr.Textbox(
+                scale=4,
+                label='세션 ID',
+                placeholder='저장한 대화의 세션 ID를 입력하면 이어서 대화할 수 있습니다.'
+            )
+            gr.Button(value="대화 이어하기", scale=1).click(
+                fn=resume_session,
+                inputs=[session_id_box, session_state],
+                outputs=[cb_chatbot, sub_image, system_text, system_age, session_state]
+            )
+
+        # 대화를 새로 시작할 때 갱신하는 컴포넌트 (페르소나 설정 화면에서도 사용)
+        reset_outputs = [cb_chatbot, sub_image, cb_user_input, system_text, system_age, session_state, session_id_box]
 
         with gr.Row():
             gr.Button(value="마지막 대화 저장", icon=r'img/free-icon-txt-file-2267023.png').click(
                 fn=counseling_bot_reset,
-                inputs=[],
-                outputs=[cb_chatbot, sub_image, cb_user_input, system_text, system_age]
+                inputs=[session_state, persona_state],
+                outputs=reset_outputs
             )
             cb_send_btn.click(
                 fn=chat_langchain,
-                inputs=[cb_user_input, cb_chatbot],
-                outputs=[cb_user_input, cb_chatbot, sub_image, system_text, system_age]
+                inputs=[cb_user_input, cb_chatbot, session_state, persona_state],
+                outputs=[cb_user_input, cb_chatbot, sub_image, system_text, system_age, session_state]
             )
             cb_user_input.submit(
                 fn=chat_langchain,
-                inputs=[cb_user_input, cb_chatbot],
-                outputs=[cb_user_input, cb_chatbot, sub_image, system_text, system_age]
+                inputs=[cb_user_input, cb_chatbot, session_state, persona_state],
+                outputs=[cb_user_input, cb_chatbot, sub_image, system_text, system_age, session_state]
             )
 
 if __name__ == "__main__":
-    app2.launch()
+    # 여러 세션의 요청을 한 프로세스에서 동시에 처리
+    app2.queue(default_concurrency_limit=CONCURRENCY_LIMIT)
+    start_metrics_server()
+    app2.launch(app_kwargs={'middleware': [cache_header_middleware()]})
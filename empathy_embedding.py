@@ -0,0 +1,51 @@
+import os
+import threading
+
+# 임베딩 방식 선택 ('chroma': Chroma 기본 ONNX 모델, 'openai': OpenAI 임베딩 API,
+# 'hash': 글자 n-gram 해싱 - 외부 서비스 없이 동작하므로 부하 테스트/시험용)
+# 적재와 검색이 같은 방식을 써야 하므로 한 곳에서만 결정합니다.
+# NumPy 색인을 쓸 때는 chromadb 없이 동작하도록 OpenAI 임베딩이 기본값입니다.
+_DEFAULT_EMBEDDING = 'openai' if os.environ.get('EMPATHY_BACKEND') == 'numpy' else 'chroma'
+EMBEDDING_BACKEND = os.environ.get('EMPATHY_EMBEDDING', _DEFAULT_EMBEDDING)
+OPENAI_EMBEDDING_MODEL = 'text-embedding-3-small'
+HASH_DIMENSIONS = 512
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def _hash_embed(texts):
+    # 어절별 글자 n-gram을 고정 차원에 해싱해서 센 벡터 (정규화는 색인/검색 쪽에서 함)
+    import zlib
+    import numpy as np
+    from lexical_index import char_ngrams
+    vectors = np.zeros((len(texts), HASH_DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for gram in char_ngrams(str(text)):
+            vectors[row, zlib.crc32(gram.encode('utf-8')) % HASH_DIMENSIONS] += 1.0
+    return vectors
+
+
+def _create_embedder():
+    if EMBEDDING_BACKEND == 'hash':
+        return _hash_embed
+    if EMBEDDING_BACKEND == 'openai':
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=OPENAI_EMBEDDING_MODEL).embed_documents
+
+    from chromadb.utils import embedding_functions
+    return embedding_functions.DefaultEmbeddingFunction()
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = _create_embedder()
+    return _embedder
+
+
+def embed_texts(texts):
+    # 백엔드마다 반환 형식(numpy 배열, 리스트)이 다르므로 float 리스트로 통일
+    return [[float(x) for x in vector] for vector in get_embedder()(list(texts))]
@@ -0,0 +1,105 @@
+import os
+import json
+import bisect
+import random
+import threading
+
+EVENTS_PATH = 'events.json'
+
+# 사춘기는 events.json이 아니라 나이 구간으로 정해지는 특별 이벤트
+PUBERTY_EVENT = {
+    "name": "사춘기",
+    "description": "사춘기가 시작되었습니다. 감정의 변화가 많아집니다. 이 시기에는 감정의 기복이 심해지고, 부모와의 대화에서 반항적인 태도를 보일 가능성이 매우 높습니다. 하지만 이해와 공감을 통해 좋은 관계를 유지할 수 있습니다."
+}
+PUBERTY_MIN_AGE = 11
+PUBERTY_MAX_AGE = 14
+
+FIRST_AGE = 5
+LAST_AGE = 20
+
+
+class EventCatalog:
+    # events.json을 한 번만 읽어 나이별로 색인하고, 파일이 바뀌었을 때만 다시 읽습니다.
+    def __init__(self, path=EVENTS_PATH):
+        self.path = path
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.common_by_age = {}
+        self._random_min_ages = []
+        self._random_events = []
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            events = json.load(file)
+
+        common_by_age = {}
+        for event in events['common_events']:
+            common_by_age.setdefault(event['age'], []).append(event)
+
+        # min_age 기준으로 정렬해 두면 "min_age <= 나이"인 이벤트는 항상 앞부분 구간
+        random_events = sorted(events['random_events'], key=lambda event: event['min_age'])
+
+        self.common_by_age = common_by_age
+        self._random_events = random_events
+        self._random_min_ages = [event['min_age'] for event in random_events]
+
+    def refresh(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._load()
+                    self._mtime = mtime
+        return self
+
+    def common_event(self, age, fired=()):
+        self.refresh()
+        for event in self.common_by_age.get(age, []):
+            if event['name'] not in fired:
+                return event
+        return None
+
+    def random_candidates(self, age, fired=()):
+        self.refresh()
+        end = bisect.bisect_right(self._random_min_ages, age)
+        return [event for event in self._random_events[:end] if event['name'] not in fired]
+
+    def next_event(self, age, fired=(), rng=random):
+        possible_events = self.random_candidates(age, fired)
+        if not possible_events:
+            return None
+        return rng.choice(possible_events)
+
+
+class EventScheduler:
+    # 세션 시작 시 나이별 이벤트 일정을 미리 정해 두고, 대화 중에는 나이로 바로 찾습니다.
+    def __init__(self, catalog, seed=None, start_age=FIRST_AGE, last_age=LAST_AGE):
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.timeline = self._build_timeline(catalog, random.Random(self.seed), int(start_age), last_age)
+
+    @staticmethod
+    def _build_timeline(catalog, rng, start_age, last_age):
+        timeline = {}
+        fired = set()
+        puberty_occurred = False
+        for age in range(start_age, last_age + 1):
+            if PUBERTY_MIN_AGE <= age <= PUBERTY_MAX_AGE and not puberty_occurred:
+                event = PUBERTY_EVENT
+                puberty_occurred = True
+            else:
+                event = catalog.common_event(age, fired) or catalog.next_event(age, fired, rng)
+            if event:
+                timeline[age] = event
+                fired.add(event['name'])
+        return timeline
+
+    def event_for(self, age):
+        # 같은 나이의 이벤트는 한 번만 발생
+        return self.timeline.pop(int(age), None)
+
+
+_catalog = EventCatalog()
+
+
+def get_catalog():
+    return _catalog.refresh()
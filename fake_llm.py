@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import threading
+
+from llm_client import to_openai_messages
+
+# 가짜 응답의 지연 시간(초): 첫 토큰까지, 이후 토큰마다
+FAKE_FIRST_TOKEN_LATENCY = float(os.environ.get('FAKE_LLM_FIRST_TOKEN_LATENCY', '0.2'))
+FAKE_TOKEN_LATENCY = float(os.environ.get('FAKE_LLM_TOKEN_LATENCY', '0.01'))
+RECORD_PATH = os.environ.get('LLM_RECORD_PATH', 'llm_recordings.jsonl')
+# 재생할 때 기록된 지연 시간에 곱할 배율 (0이면 지연 없이 재생)
+REPLAY_LATENCY_SCALE = float(os.environ.get('LLM_REPLAY_LATENCY_SCALE', '1.0'))
+
+FAKE_REPLIES = [
+    "오늘 학교에서 친구랑 같이 놀았어요. 정말 재미있었어요! 😊",
+    "음... 그건 잘 모르겠어요. 조금 헷갈려요 😳",
+    "왜 맨날 나한테만 그래요? 😠",
+    "내일 발표가 있는데 너무 떨려요 😰",
+    "친구가 나를 빼고 놀아서 속상했어요 😢",
+    "키우던 강아지가 아파서 슬퍼요 😔",
+]
+
+FAKE_REVIEW_COMMENTS = [
+    "아이의 감정을 먼저 말로 짚어 주면 더 좋아요.",
+    "질문보다 아이의 말을 한 번 더 되짚어 주세요.",
+    "충분히 공감하며 대답했어요.",
+]
+
+# 대화 전체 평가 프롬프트의 턴 블록 ([턴 N]으로 시작)
+_REVIEW_BLOCK = re.compile(r'^\[턴 (\d+)\]\n(.*?)(?=^\[턴 |\Z)', re.M | re.S)
+
+
+def prompt_hash(messages, model):
+    # 같은 모델에 같은 메시지 목록이면 같은 키
+    payload = json.dumps([model, to_openai_messages(messages)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def review_reply(messages):
+    # 대화 전체 평가 요청이면 턴마다 점수를 매긴 JSON 배열, 아니면 None
+    converted = to_openai_messages(messages)
+    if not converted or 'JSON 배열' not in converted[0].get('content', ''):
+        return None
+    reviews = []
+    for number, block in _REVIEW_BLOCK.findall(converted[-1].get('content', '')):
+        digest = int(hashlib.sha256(block.encode('utf-8')).hexdigest(), 16)
+        reviews.append({'turn': int(number), 'score': digest % 5 + 1,
+                        'comment': FAKE_REVIEW_COMMENTS[digest % len(FAKE_REVIEW_COMMENTS)]})
+    return json.dumps(reviews, ensure_ascii=False) if reviews else None
+
+
+def split_tokens(text):
+    # 스트리밍 흉내: 글자 두 개씩 나눠서 보냄
+    return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+
+class FakeLLMClient:
+    # 실제 API 없이 프롬프트 해시로 정해지는 답변을 지연 시간과 함께 돌려주는 클라이언트
+    def __init__(self, first_token_latency=FAKE_FIRST_TOKEN_LATENCY, token_latency=FAKE_TOKEN_LATENCY, replies=FAKE_REPLIES):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.replies = replies
+
+    def reply_for(self, messages, model):
+        review = review_reply(messages)
+        if review is not None:
+            return review
+        return self.replies[int(prompt_hash(messages, model), 16) % len(self.replies)]
+
+    async def chat(self, messages, model=None, **params):
+        text = self.reply_for(messages, model)
+        await asyncio.sleep(self.first_token_latency + self.token_latency * len(split_tokens(text)))
+        return text
+
+    async def stream(self, messages, model=None, **params):
+        text = self.reply_for(messages, model)
+        await asyncio.sleep(self.first_token_latency)
+        for i, token in enumerate(split_tokens(text)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield token
+
+    async def aclose(self):
+        pass
+
+
+class RecordReplayClient:
+    # record: 실제 클라이언트의 응답을 프롬프트 해시로 기록 / replay: 기록된 응답을 지연 시간과 함께 재생
+    def __init__(self, inner, path=RECORD_PATH, mode='replay', fallback=None, latency_scale=REPLAY_LATENCY_SCALE):
+        self.inner = inner
+        self.latency_scale = latency_scale
+        self.path = path
+        self.mode = mode
+        self.fallback = fallback
+        self.recordings = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.recordings[entry['key']] = entry
+
+    def _record(self, key, model, text, elapsed):
+        entry = {'key': key, 'model': model, 'response': text, 'elapsed': elapsed}
+        with self._lock:
+            self.recordings[key] = entry
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def _lookup(self, messages, model):
+        key = prompt_hash(messages, model)
+        entry = self.recordings.get(key)
+        if entry is None and self.fallback is None:
+            raise KeyError(f"기록된 응답이 없습니다: {key}")
+        return key, entry
+
+    async def chat(self, messages, model=None, **params):
+        if self.mode == 'record':
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            text = await self.inner.chat(messages, model, **params)
+            self._record(prompt_hash(messages, model), model, text, loop.time() - started)
+            return text
+
+        key, entry = self._lookup(messages, model)
+        if entry is None:
+            return await self.fallback.chat(messages, model, **params)
+        await asyncio.sleep(entry['elapsed'] * self.latency_scale)
+        return entry['response']
+
+    async def stream(self, messages, model=None, **params):
+        if self.mode == 'record':
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            tokens = []
+            async for token in self.inner.stream(messages, model, **params):
+                tokens.append(token)
+                yield token
+            self._record(prompt_hash(messages, model), model, ''.join(tokens), loop.time() - started)
+            return
+
+        key, entry = self._lookup(messages, model)
+        if entry is None:
+            async for token in self.fallback.stream(messages, model, **params):
+                yield token
+            return
+        tokens = split_tokens(entry['response'])
+        for token in tokens:
+            await asyncio.sleep(entry['elapsed'] * self.latency_scale / max(1, len(tokens)))
+            yield token
+
+    async def aclose(self):
+        await self.inner.aclose()
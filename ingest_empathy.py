@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from Chroma_consultant import CSV_PATH, DB_PATH, COLLECTION_NAME, NUMPY_INDEX_DIR, VECTOR_BACKEND, METADATA_COLUMNS
+from empathy_embedding import embed_texts
+
+MANIFEST_NAME = 'ingest_manifest.json'
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest, manifest_path):
+    # 임시 파일에 쓴 뒤 교체해서 중간에 멈춰도 이전 manifest가 남도록 함
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def row_metadata(row):
+    # 결측값(NaN)은 메타데이터로 저장할 수 없으므로 빈 문자열로 저장
+    return {column: '' if pd.isna(row[column]) else str(row[column]) for column in METADATA_COLUMNS}
+
+
+def content_hash(text, metadata):
+    payload = json.dumps([text, metadata], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def iter_documents(csv_path, chunksize):
+    # CSV를 청크 단위로 읽으면서 (문서 id, 텍스트, 메타데이터)를 차례로 돌려줌
+    turn_counts = {}
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        for _, row in chunk.iterrows():
+            dialogue_id = row['id']
+            turn = turn_counts.get(dialogue_id, 0)
+            turn_counts[dialogue_id] = turn + 1
+            yield f"{dialogue_id}_{turn}", str(row['text']), row_metadata(row)
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def ingest(csv_path=CSV_PATH, db_path=DB_PATH, collection_name=COLLECTION_NAME,
+           chunksize=1000, batch_size=64, workers=4, full=False):
+    import chromadb
+    client = chromadb.PersistentClient(path=db_path)
+    collection = client.get_or_create_collection(collection_name)
+
+    manifest_path = os.path.join(db_path, MANIFEST_NAME)
+    manifest = {} if full else load_manifest(manifest_path)
+
+    seen = set()
+    upserted = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for doc_id, text, metadata in iter_documents(csv_path, chunksize):
+            seen.add(doc_id)
+            digest = content_hash(text, metadata)
+            if manifest.get(doc_id) != digest:
+                pending.append((doc_id, text, metadata, digest))
+
+            if len(pending) >= chunksize:
+                upserted += _upsert_changed(collection, executor, pending, batch_size, manifest)
+                save_manifest(manifest, manifest_path)
+                pending = []
+
+        if pending:
+            upserted += _upsert_changed(collection, executor, pending, batch_size, manifest)
+
+    # CSV에서 사라진 문서는 컬렉션에서도 삭제 (전체 재적재 시에는 manifest가 비어 있으므로 컬렉션의 id와 비교)
+    known = collection.get(include=[])['ids'] if full else list(manifest)
+    removed = [doc_id for doc_id in known if doc_id not in seen]
+    if removed:
+        collection.delete(ids=removed)
+        for doc_id in removed:
+            manifest.pop(doc_id, None)
+
+    save_manifest(manifest, manifest_path)
+    return {'total': len(seen), 'upserted': upserted, 'removed': len(removed)}
+
+
+def _upsert_changed(collection, executor, changed, batch_size, manifest):
+    # 임베딩은 배치 단위로 작업자들에게 나누고, 컬렉션 쓰기는 한 스레드에서만 수행
+    batches = list(batched(changed, batch_size))
+    embeddings = executor.map(lambda batch: embed_texts([text for _, text, _, _ in batch]), batches)
+
+    for batch, batch_embeddings in zip(batches, embeddings):
+        collection.upsert(
+            ids=[doc_id for doc_id, _, _, _ in batch],
+            documents=[text for _, text, _, _ in batch],
+            metadatas=[metadata for _, _, metadata, _ in batch],
+            embeddings=batch_embeddings
+        )
+        for doc_id, _, _, digest in batch:
+            manifest[doc_id] = digest
+    return len(changed)
+
+
+def ingest_numpy(csv_path=CSV_PATH, index_dir=NUMPY_INDEX_DIR, chunksize=1000, batch_size=64,
+                 workers=4, full=False, dtype='float16', nlist=0):
+    from numpy_index import NumpyVectorIndex, build_index
+
+    manifest_path = os.path.join(index_dir, MANIFEST_NAME)
+    manifest = {} if full else load_manifest(manifest_path)
+
+    # 바뀌지 않은 문서는 기존 색인의 벡터를 그대로 재사용
+    previous = {}
+    if manifest:
+        try:
+            previous = NumpyVectorIndex(index_dir).vectors_by_id()
+        except FileNotFoundError:
+            manifest = {}
+
+    ids, metadatas, vectors, changed, digests = [], [], {}, [], {}
+    for doc_id, text, metadata in iter_documents(csv_path, chunksize):
+        digest = content_hash(text, metadata)
+        digests[doc_id] = digest
+        ids.append(doc_id)
+        metadatas.append(metadata)
+        if manifest.get(doc_id) == digest and doc_id in previous:
+            vectors[doc_id] = previous[doc_id]
+        else:
+            changed.append((doc_id, text, metadata, digest))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batches = list(batched(changed, batch_size))
+        embeddings = executor.map(lambda batch: embed_texts([text for _, text, _, _ in batch]), batches)
+        for batch, batch_embeddings in zip(batches, embeddings):
+            for (doc_id, _, _, _), embedding in zip(batch, batch_embeddings):
+                vectors[doc_id] = embedding
+
+    # 행렬 재작성은 임베딩에 비해 매우 싸므로 매번 전체를 다시 씀
+    build_index(ids, [vectors[doc_id] for doc_id in ids], metadatas, index_dir, dtype=dtype, nlist=nlist)
+
+    removed = [doc_id for doc_id in manifest if doc_id not in digests]
+    save_manifest(digests, manifest_path)
+    return {'total': len(ids), 'upserted': len(changed), 'removed': len(removed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='공감형 대화 CSV를 벡터 컬렉션에 증분 적재합니다.')
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--collection', default=COLLECTION_NAME)
+    parser.add_argument('--chunksize', type=int, default=1000, help='CSV를 한 번에 읽을 행 수')
+    parser.add_argument('--batch-size', type=int, default=64, help='임베딩 한 번에 보낼 문서 수')
+    parser.add_argument('--workers', type=int, default=4, help='임베딩 작업자 수')
+    parser.add_argument('--full', action='store_true', help='manifest를 무시하고 전체를 다시 적재')
+    parser.add_argument('--backend', choices=['chroma', 'numpy'], default=VECTOR_BACKEND, help='적재할 벡터 검색 백엔드')
+    parser.add_argument('--index-dir', default=NUMPY_INDEX_DIR, help='NumPy 색인 디렉터리')
+    parser.add_argument('--dtype', choices=['float16', 'int8'], default='float16', help='NumPy 색인의 저장 형식')
+    parser.add_argument('--nlist', type=int, default=0, help='IVF 군집 수 (0이면 전체 검색)')
+    args = parser.parse_args()
+
+    if args.backend == 'numpy':
+        summary = ingest_numpy(args.csv, args.index_dir, args.chunksize, args.batch_size, args.workers,
+                               args.full, args.dtype, args.nlist)
+    else:
+        summary = ingest(args.csv, args.db, args.collection, args.chunksize, args.batch_size, args.workers, args.full)
+    print(f"전체 {summary['total']}건 중 {summary['upserted']}건 적재, {summary['removed']}건 삭제")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from conversation_memory import count_tokens, truncate_to_tokens, summarize_turn
+from llm_client import get_llm_pool
+from metrics import span, record_error
+
+# 요약은 가벼운 모델로, 편지는 자녀 대화와 같은 모델로 작성
+DIGEST_MODEL = "gpt-4o-mini"
+LETTER_MODEL = "gpt-4o"
+
+# 나이별 요약, 단계별 요약의 토큰 상한과 요약 요청 한 번에 넣을 대화의 토큰 상한
+AGE_DIGEST_TOKENS = 150
+STAGE_DIGEST_TOKENS = 300
+PERIOD_INPUT_TOKENS = 2000
+# 편지 프롬프트에 그대로 넣을 마지막 대화 수
+LETTER_RECENT_TURNS = 3
+
+DIGEST_WORKERS = 2
+_executor = ThreadPoolExecutor(max_workers=DIGEST_WORKERS, thread_name_prefix='digest')
+
+
+def _child(persona):
+    return f"{persona['name']}({persona['role']})"
+
+
+def build_age_digest_prompt(persona, age, stage, turns, events):
+    # map: 한 살 동안의 대화와 이벤트를 짧은 요약으로
+    lines = [f"부모: {user_input}\n자녀: {response}" for user_input, response in turns]
+    conversation = '\n'.join(lines)
+    if count_tokens(conversation) > PERIOD_INPUT_TOKENS:
+        conversation = truncate_to_tokens(conversation, PERIOD_INPUT_TOKENS)
+    event_text = ', '.join(events) if events else '없음'
+    return [
+        {'role': 'system', 'content': f'''
+        당신은 {_child(persona)}의 성장 기록을 정리하는 기록자입니다.
+        아래는 {_child(persona)}가 {int(age)}세({stage}) 때 {persona['parent_role']}와 나눈 대화입니다.
+        부모가 아이를 대한 태도, 아이가 느낀 감정, 기억에 남을 만한 일을 {AGE_DIGEST_TOKENS}토큰 이내의 한국어 문장 몇 개로 요약하세요.
+        '''},
+        {'role': 'user', 'content': f"이 시기의 이벤트: {event_text}\n대화:\n{conversation}"},
+    ]
+
+
+def build_stage_digest_prompt(persona, stage, digests):
+    # reduce: 한 단계(유아, 초등학생, …)의 나이별 요약을 하나로
+    text = '\n'.join(f"[{int(age)}세] {digest}" for age, digest in digests)
+    return [
+        {'role': 'system', 'content': f'''
+        아래는 {_child(persona)}가 {stage}였던 시기의 나이별 요약입니다.
+        이 시기 부모와의 관계에서 고마웠던 점, 아쉬웠던 점, 중요한 사건을 {STAGE_DIGEST_TOKENS}토큰 이내로 하나의 요약으로 합치세요.
+        '''},
+        {'role': 'user', 'content': text},
+    ]
+
+
+def build_letter_prompt(persona, stage_digests, recent_turns):
+    text = '\n'.join(f"[{stage} 시기] {digest}" for stage, digest in stage_digests)
+    recent = '\n'.join(f"부모: {user_input}\n자녀: {response}" for user_input, response in recent_turns)
+    return [
+        {'role': 'system', 'content': f'''
+        당신은 {persona['name']}, {persona['gender']}인 {persona['role']}이고 이제 20세 성인이 되었습니다.
+        말투는 {persona['speaking_style']}. 사용자(부모님)는 {persona['parent_role']}입니다.
+        아래의 시기별 요약은 여태까지 사용자(부모)와 나누었던 대화를 정리한 것입니다.
+        이를 바탕으로 사용자(부모)가 어떤 부모였는지 편지를 작성하세요.
+        편지에는 부모에게 감사했던 점이나 부족했던 점을 포함하여, 자녀의 입장에서 솔직하게 느낀 감정과 생각을 담아주세요.
+        이 편지는 부모가 자녀와의 대화를 돌아보고, 앞으로의 관계를 더욱 좋게 발전시킬 수 있도록 돕는 역할을 합니다.
+        '''},
+        {'role': 'user', 'content': f"시기별 요약:\n{text}\n\n마지막 대화:\n{recent}"},
+    ]
+
+
+def _fallback_digest(lines, max_tokens):
+    # LLM 요약에 실패하면 발화 앞부분만 남긴 줄을 토큰 상한까지 사용
+    return truncate_to_tokens('\n'.join(lines), max_tokens)
+
+
+class DigestBook:
+    # 나이가 오를 때마다 지난 한 살 동안의 대화를 백그라운드에서 짧은 요약으로 접어 두고,
+    # 단계(유아 → 초등학생 → …)가 바뀌면 그 단계의 나이별 요약을 다시 하나로 합칩니다.
+    # 20세 편지는 단계 요약 몇 개만으로 쓰므로 대화 길이와 관계없이 프롬프트 크기가 일정합니다.
+    def __init__(self, persona, session_id=None, on_digest=None):
+        self.persona = persona
+        self.session_id = session_id
+        # 요약이 끝날 때마다 호출 (level, key, text) - 세션 저장소 기록용
+        self.on_digest = on_digest
+        self.turns = []
+        self.events = []
+        self.recent_turns = deque(maxlen=LETTER_RECENT_TURNS)
+        # 나이 → 요약 (문자열 또는 계산 중인 Future), 요약 전 입력
+        self.age_digests = {}
+        self.age_inputs = {}
+        self.stage_ages = {}
+        # 단계 → 요약 (문자열 또는 계산 중인 Future)
+        self.stage_digests = {}
+        self.stage_order = []
+        self._lock = threading.Lock()
+
+    def add_turn(self, user_input, response):
+        self.turns.append((user_input, response))
+        self.recent_turns.append((user_input, response))
+
+    def add_event(self, name):
+        self.events.append(name)
+
+    def close_period(self, age, stage, next_stage, schedule=True):
+        # age세(stage)가 끝났을 때 호출. schedule=False면 요약을 예약하지 않고 필요할 때 계산 (이어하기 복원용)
+        with self._lock:
+            # 복원 시에는 요약 기록이 나이 변화 기록보다 먼저 나올 수 있음
+            if not isinstance(self.age_digests.get(age), str):
+                self.age_inputs[age] = (stage, self.turns, self.events)
+            self.turns, self.events = [], []
+            if stage not in self.stage_ages:
+                self.stage_ages[stage] = []
+                self.stage_order.append(stage)
+            self.stage_ages[stage].append(age)
+            # 작업은 제출 순서대로 시작되므로 단계 요약이 기다리는 나이별 요약은 항상 먼저 실행 중이거나 끝나 있음
+            if schedule:
+                self.age_digests[age] = _executor.submit(self._summarize_age, age)
+                if stage != next_stage:
+                    self.stage_digests[stage] = _executor.submit(self._summarize_stage, stage)
+
+    def restore_digest(self, level, key, text):
+        with self._lock:
+            if level == 'age':
+                self.age_digests[key] = text
+                self.age_inputs.pop(key, None)
+            else:
+                self.stage_digests[key] = text
+
+    def _resolve(self, digests, key, compute):
+        with self._lock:
+            value = digests.get(key)
+        if isinstance(value, str):
+            return value
+        if value is not None:
+            try:
+                text = value.result()
+            except CancelledError:
+                text = compute()
+        else:
+            # 예약되지 않은 요약(이어하기로 복원한 시기, 마지막 단계)은 필요할 때 바로 계산
+            text = compute()
+        with self._lock:
+            if not isinstance(digests.get(key), str):
+                digests[key] = text
+        return text
+
+    def age_digest(self, age):
+        return self._resolve(self.age_digests, age, lambda: self._summarize_age(age))
+
+    def stage_digest(self, stage):
+        return self._resolve(self.stage_digests, stage, lambda: self._summarize_stage(stage))
+
+    def _summarize_age(self, age):
+        with self._lock:
+            stage, turns, events = self.age_inputs.get(age, (None, [], []))
+        try:
+            with span('letter_digest', self.session_id, level='age', age=age):
+                text = get_llm_pool().chat(build_age_digest_prompt(self.persona, age, stage, turns, events),
+                                           model=DIGEST_MODEL)
+            text = truncate_to_tokens(text.strip(), AGE_DIGEST_TOKENS * 2)
+        except Exception as e:
+            record_error('letter_digest', self.session_id, e)
+            print(f"{age}세 대화 요약 중 오류 발생: {e}")
+            text = _fallback_digest([summarize_turn(user_input, response) for user_input, response in turns],
+                                    AGE_DIGEST_TOKENS)
+        with self._lock:
+            self.age_inputs.pop(age, None)
+        self._notify('age', age, text)
+        return text
+
+    def _summarize_stage(self, stage):
+        with self._lock:
+            ages = list(self.stage_ages.get(stage, []))
+        digests = [(age, self.age_digest(age)) for age in ages]
+        try:
+            with span('letter_digest', self.session_id, level='stage', stage=stage, ages=len(ages)):
+                text = get_llm_pool().chat(build_stage_digest_prompt(self.persona, stage, digests), model=DIGEST_MODEL)
+            text = truncate_to_tokens(text.strip(), STAGE_DIGEST_TOKENS * 2)
+        except Exception as e:
+            record_error('letter_digest', self.session_id, e)
+            print(f"{stage} 시기 요약 중 오류 발생: {e}")
+            text = _fallback_digest([f"[{int(age)}세] {digest}" for age, digest in digests], STAGE_DIGEST_TOKENS)
+        self._notify('stage', stage, text)
+        return text
+
+    def _notify(self, level, key, text):
+        if self.on_digest is not None:
+            try:
+                self.on_digest(level, key, text)
+            except Exception as e:
+                print(f"대화 요약 기록 중 오류 발생: {e}")
+
+    def letter_prompt(self):
+        # 아직 합치지 않은 마지막 단계까지 합친 뒤, 단계 요약(최대 5개)과 마지막 몇 턴만으로 편지 프롬프트를 만듦
+        with self._lock:
+            stages = list(self.stage_order)
+            recent = list(self.recent_turns)
+        stage_digests = [(stage, self.stage_digest(stage)) for stage in stages]
+        return build_letter_prompt(self.persona, stage_digests, recent)
+
+    def stream_letter(self):
+        prompt = self.letter_prompt()
+        with span('letter_write', self.session_id, model=LETTER_MODEL):
+            for content in get_llm_pool().stream(prompt, model=LETTER_MODEL):
+                yield content
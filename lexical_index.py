@@ -0,0 +1,87 @@
+import re
+import math
+from collections import Counter
+
+import numpy as np
+
+from cache import normalize_text
+
+# 어절마다 글자 2-gram, 3-gram을 색인 (조사/어미가 붙어도 어간 부분이 겹치도록)
+NGRAM_SIZES = (2, 3)
+
+# BM25 매개변수
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_NON_WORD = re.compile(r'[^\w\s]')
+
+
+def char_ngrams(text, sizes=NGRAM_SIZES):
+    grams = []
+    for token in _NON_WORD.sub(' ', normalize_text(text)).lower().split():
+        if len(token) < min(sizes):
+            grams.append(token)
+            continue
+        for size in sizes:
+            grams.extend(token[i:i + size] for i in range(len(token) - size + 1))
+    return grams
+
+
+class NgramIndex:
+    # 자녀 발화의 글자 n-gram 역색인. 질의와 겹치는 n-gram이 많은 발화를 BM25 점수로 빠르게 추려 냄
+    def __init__(self, doc_ids, texts):
+        self.doc_ids = list(doc_ids)
+        counts = [Counter(char_ngrams(text)) for text in texts]
+        lengths = np.array([sum(count.values()) for count in counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+
+        postings = {}
+        for doc, count in enumerate(counts):
+            for gram, tf in count.items():
+                postings.setdefault(gram, ([], []))
+                postings[gram][0].append(doc)
+                postings[gram][1].append(tf)
+
+        # 문서 길이 정규화까지 반영한 BM25 가중치를 미리 계산해 두고, 질의 시에는 더하기만 함
+        doc_count = len(self.doc_ids)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length) if average_length else lengths
+        self.postings = {}
+        for gram, (docs, tfs) in postings.items():
+            docs = np.array(docs, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[gram] = (docs, (idf * tfs * (BM25_K1 + 1) / (tfs + norms[docs])).astype(np.float32))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def shortlist(self, query_text, cap):
+        # 점수가 0보다 큰 상위 cap개의 (문서 id, 어휘 점수)
+        grams = set(char_ngrams(query_text))
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > cap:
+            candidates = candidates[np.argpartition(-scores[candidates], cap - 1)[:cap]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.doc_ids[doc], float(scores[doc])) for doc in candidates]
+
+
+def build_child_indexes(store, child_role):
+    # 벡터 DB와 같은 문서 id({대화 id}_{턴 번호})로 자녀 발화만 색인
+    # None 키는 전체 색인, 나머지는 감정 분류(category)별 색인
+    docs = []
+    for dialogue_id in store.ids:
+        for position, turn in enumerate(store.turns(dialogue_id)):
+            if turn['role'] == child_role:
+                docs.append((f"{dialogue_id}_{position}", turn['text'], turn['category']))
+
+    indexes = {None: NgramIndex([doc_id for doc_id, _, _ in docs], [text for _, text, _ in docs])}
+    for category in sorted({category for _, _, category in docs}):
+        partition = [(doc_id, text) for doc_id, text, doc_category in docs if doc_category == category]
+        indexes[category] = NgramIndex([doc_id for doc_id, _ in partition], [text for _, text in partition])
+    return indexes
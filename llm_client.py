@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import threading
+
+import httpx
+
+from metrics import observe_queue_wait
+
+# OpenAI 호환 API 설정 (OPENAI_BASE_URL을 로컬 스텁 서버로 바꿔 테스트할 수 있음)
+BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+DEFAULT_MODEL = 'gpt-4o'
+
+# 백엔드 선택 ('openai': 실제 API, 'fake': 가짜 응답, 'record': 실제 응답 기록, 'replay': 기록 재생)
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'openai')
+
+# 초당 요청 수, 순간 최대 요청 수, 동시 요청 수, 요청 제한 시간(초), 재시도 횟수
+RATE_LIMIT = float(os.environ.get('LLM_RATE_LIMIT', '5'))
+RATE_BURST = int(os.environ.get('LLM_RATE_BURST', '10'))
+MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '60'))
+MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '3'))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_ROLES = {'system': 'system', 'human': 'user', 'ai': 'assistant'}
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMResponseError(LLMError):
+    # 응답 본문이나 스트리밍 조각을 해석하지 못함 (잘린 응답일 수 있으므로 재시도 대상)
+    pass
+
+
+def _parse_message(response):
+    try:
+        return response.json()['choices'][0]['message']['content']
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise LLMResponseError(f"LLM 응답 해석 실패: {e!r}: {response.text[:200]}") from e
+
+
+def _parse_chunk(data):
+    try:
+        choices = json.loads(data).get('choices') or [{}]
+        return choices[0].get('delta', {}).get('content')
+    except (ValueError, AttributeError, IndexError, TypeError) as e:
+        raise LLMResponseError(f"LLM 스트리밍 조각 해석 실패: {e!r}: {data[:200]}") from e
+
+
+def to_openai_messages(messages):
+    # LangChain 메시지와 dict 메시지를 모두 OpenAI 형식으로 변환
+    converted = []
+    for message in messages:
+        if isinstance(message, dict):
+            converted.append(message)
+        else:
+            converted.append({'role': _ROLES.get(message.type, 'user'), 'content': message.content})
+    return converted
+
+
+class TokenBucket:
+    # 초당 rate개씩 채워지고 최대 capacity개까지 쌓이는 토큰 버킷
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _backoff(attempt, retry_after=None):
+    # 지수 백오프에 full jitter를 적용하고, 서버가 Retry-After를 주면 그 이상 기다림
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+class AsyncLLMClient:
+    # 연결을 재사용하는 비동기 채팅 API 클라이언트 (속도 제한, 동시성 제한, 재시도 포함)
+    def __init__(self, base_url=BASE_URL, api_key=None, rate=RATE_LIMIT, burst=RATE_BURST,
+                 max_concurrency=MAX_CONCURRENCY, timeout=TIMEOUT, max_retries=MAX_RETRIES):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate, burst)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+
+    def _headers(self):
+        api_key = self.api_key or os.environ.get('OPENAI_API_KEY', '')
+        return {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
+
+    def _payload(self, messages, model, stream, params):
+        payload = {'model': model or DEFAULT_MODEL, 'messages': to_openai_messages(messages), 'stream': stream}
+        payload.update(params)
+        return payload
+
+    async def chat(self, messages, model=None, **params):
+        payload = self._payload(messages, model, False, params)
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            await self._bucket.acquire()
+            try:
+                async with self._semaphore:
+                    observe_queue_wait('llm', time.monotonic() - queued)
+                    response = await asyncio.wait_for(
+                        self._client.post(f'{self.base_url}/chat/completions', json=payload, headers=self._headers()),
+                        self.timeout
+                    )
+                if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                    await asyncio.sleep(_backoff(attempt, response.headers.get('retry-after')))
+                    continue
+                if response.status_code >= 400:
+                    raise LLMError(f"LLM API 오류 {response.status_code}: {response.text[:500]}")
+                return _parse_message(response)
+            except (httpx.TransportError, httpx.DecodingError, asyncio.TimeoutError, LLMResponseError) as e:
+                if attempt >= self.max_retries:
+                    raise LLMError(f"LLM API 요청 실패: {e!r}") from e
+                await asyncio.sleep(_backoff(attempt))
+
+    async def stream(self, messages, model=None, **params):
+        payload = self._payload(messages, model, True, params)
+        for attempt in range(self.max_retries + 1):
+            emitted = False
+            retry_after = None
+            queued = time.monotonic()
+            await self._bucket.acquire()
+            try:
+                async with self._semaphore:
+                    observe_queue_wait('llm', time.monotonic() - queued)
+                    async with self._client.stream('POST', f'{self.base_url}/chat/completions',
+                                                   json=payload, headers=self._headers()) as response:
+                        if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                            retry_after = response.headers.get('retry-after')
+                        elif response.status_code >= 400:
+                            body = (await response.aread()).decode('utf-8', 'replace')
+                            raise LLMError(f"LLM API 오류 {response.status_code}: {body[:500]}")
+                        else:
+                            async for line in response.aiter_lines():
+                                if not line.startswith('data:'):
+                                    continue
+                                data = line[5:].strip()
+                                if data == '[DONE]':
+                                    break
+                                content = _parse_chunk(data)
+                                if content:
+                                    emitted = True
+                                    yield content
+                            return
+                await asyncio.sleep(_backoff(attempt, retry_after))
+            except (httpx.TransportError, httpx.DecodingError, asyncio.TimeoutError, LLMResponseError) as e:
+                # 이미 일부 토큰을 보냈다면 중복을 막기 위해 재시도하지 않음
+                if emitted or attempt >= self.max_retries:
+                    raise LLMError(f"LLM API 스트리밍 실패: {e!r}") from e
+                await asyncio.sleep(_backoff(attempt))
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+def create_client(backend=None, **client_options):
+    # 이벤트 루프 안에서 호출해야 함 (클라이언트가 루프에 묶인 잠금을 만듦)
+    backend = backend or LLM_BACKEND
+    if backend == 'openai':
+        return AsyncLLMClient(**client_options)
+
+    from fake_llm import FakeLLMClient, RecordReplayClient
+    if backend == 'fake':
+        return FakeLLMClient()
+    if backend == 'record':
+        return RecordReplayClient(AsyncLLMClient(**client_options), mode='record')
+    if backend == 'replay':
+        # 기록에 없는 프롬프트는 가짜 응답으로 대체
+        return RecordReplayClient(FakeLLMClient(), mode='replay', fallback=FakeLLMClient())
+    raise ValueError(f"알 수 없는 LLM 백엔드: {backend}")
+
+
+class LLMPool:
+    # 전용 스레드의 이벤트 루프 하나에서 공유 클라이언트를 실행하고, 동기 코드(Gradio 핸들러)에서 호출할 수 있게 합니다.
+    def __init__(self, backend=None, **client_options):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='llm-pool', daemon=True)
+        self._thread.start()
+        self.client = self._run(self._create_client(backend, client_options))
+
+    @staticmethod
+    async def _create_client(backend, client_options):
+        return create_client(backend, **client_options)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def chat(self, messages, model=None, **params):
+        return self._run(self.client.chat(messages, model, **params))
+
+    def stream(self, messages, model=None, **params):
+        # 비동기 스트림을 큐로 받아서 동기 제너레이터로 전달
+        chunks = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for content in self.client.stream(messages, model, **params):
+                    chunks.put(content)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._loop)
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def close(self):
+        self._run(self.client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = LLMPool()
+    return _pool
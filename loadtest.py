@@ -0,0 +1,374 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+import uuid
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from simulate import load_parent_generator
+
+DEFAULT_URL = 'http://127.0.0.1:7860/'
+DEFAULT_METRICS_URL = 'http://127.0.0.1:9100/metrics.json'
+
+# 대화 화면의 API 이름 (Gradio가 함수 이름으로 붙임)
+CHAT_API = 'chat_langchain'
+EVALUATE_API = 'evaluate_response'
+REQUEST_TIMEOUT = 120
+
+# --launch 시 상담사 평가의 검색도 외부 서비스 없이 동작하도록 해싱 임베딩의 NumPy 색인을 사용
+LAUNCH_RETRIEVAL_ENV = {
+    'EMPATHY_BACKEND': 'numpy',
+    'EMPATHY_EMBEDDING': 'hash',
+    'EMPATHY_INDEX_DIR': 'empathy_index_hash',
+}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class LoadResult:
+    # 동시성 단계 하나에서 요청별 소요 시간, 대기열 대기 시간, 첫 출력까지 시간, 오류를 모읍니다.
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+        self.requests = {}
+        self.error_samples = []
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, timings=None, error=None):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if error is None:
+                for name, value in timings.items():
+                    self.timings.setdefault(endpoint, {}).setdefault(name, []).append(value)
+            else:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.append(f"{endpoint}: {error.splitlines()[0][:200]}")
+
+
+def load_endpoints(url):
+    # 앱 설정에서 API 이름별 fn_index와 입력 컴포넌트 종류를 읽음
+    import httpx
+
+    config = httpx.get(url.rstrip('/') + '/config', timeout=30).json()
+    components = {component['id']: component['type'] for component in config['components']}
+    endpoints = {}
+    for fn_index, dependency in enumerate(config['dependencies']):
+        name = dependency.get('api_name')
+        if name in (CHAT_API, EVALUATE_API) and name not in endpoints:
+            endpoints[name] = {
+                'fn_index': fn_index,
+                'trigger_id': dependency.get('id'),
+                'inputs': [components[input_id] for input_id in dependency['inputs']],
+            }
+    missing = {CHAT_API, EVALUATE_API} - set(endpoints)
+    if missing:
+        raise RuntimeError(f"앱에서 API를 찾을 수 없습니다: {', '.join(sorted(missing))}")
+    return endpoints
+
+
+class GradioSession:
+    # Gradio 대기열 프로토콜(/queue/join + /queue/data SSE)을 직접 사용하는 세션 하나 (브라우저 탭 하나와 같음)
+    # 서버가 보내는 대기열 통과(process_starts), 첫 출력, 완료 메시지 시각으로 구간별 시간을 잽니다.
+    def __init__(self, url, endpoints):
+        import httpx
+
+        self.url = url.rstrip('/')
+        self.endpoints = endpoints
+        self.session_hash = uuid.uuid4().hex[:11]
+        self.http = httpx.Client(timeout=REQUEST_TIMEOUT)
+
+    def call(self, endpoint, values):
+        # values는 입력 컴포넌트 종류별 값 (state는 서버가 세션에서 채우므로 None)
+        spec = self.endpoints[endpoint]
+        data = [None if kind == 'state' else values[kind] for kind in spec['inputs']]
+        started = time.perf_counter()
+        timings = {}
+        response = self.http.post(f"{self.url}/queue/join", json={
+            'data': data,
+            'fn_index': spec['fn_index'],
+            'trigger_id': spec['trigger_id'],
+            'session_hash': self.session_hash,
+            'event_data': None,
+        })
+        response.raise_for_status()
+        event_id = response.json()['event_id']
+
+        with self.http.stream('GET', f"{self.url}/queue/data", params={'session_hash': self.session_hash}) as stream:
+            for line in stream.iter_lines():
+                if not line.startswith('data:'):
+                    continue
+                message = json.loads(line[len('data:'):])
+                if message.get('event_id') != event_id:
+                    continue
+                elapsed = time.perf_counter() - started
+                if message['msg'] == 'process_starts':
+                    timings['queue_wait'] = elapsed
+                elif message['msg'] == 'process_generating':
+                    timings.setdefault('first_output', elapsed)
+                elif message['msg'] == 'process_completed':
+                    timings['latency'] = elapsed
+                    timings.setdefault('queue_wait', elapsed)
+                    timings.setdefault('first_output', elapsed)
+                    output = message.get('output') or {}
+                    if not message.get('success'):
+                        raise RuntimeError(output.get('error') or '처리 실패')
+                    return output['data'], timings
+        raise RuntimeError('응답이 끝나기 전에 연결이 끊겼습니다')
+
+    def close(self):
+        self.http.close()
+
+
+def call(session, result, endpoint, values):
+    try:
+        outputs, timings = session.call(endpoint, values)
+    except Exception as e:
+        result.add(endpoint, error=f"{type(e).__name__}: {e}")
+        return None
+    # 앱은 예외를 'Error: ...' 문자열로 돌려주므로 이것도 오류로 셈
+    if isinstance(outputs[0], str) and outputs[0].startswith('Error:'):
+        result.add(endpoint, error=outputs[0])
+        return None
+    result.add(endpoint, timings)
+    return outputs
+
+
+def run_session(url, endpoints, result, style, turns, think_time, evaluate_every, seed):
+    rng = random.Random(seed)
+    generate = load_parent_generator(style)
+    session = GradioSession(url, endpoints)
+    history = []
+    try:
+        for turn in range(turns):
+            if think_time:
+                time.sleep(rng.uniform(0, 2 * think_time))
+            outputs = call(session, result, CHAT_API, {'textbox': generate(history, None, rng), 'chatbot': history})
+            if outputs is None:
+                continue
+            history = outputs[1]
+            if evaluate_every and (turn + 1) % evaluate_every == 0:
+                call(session, result, EVALUATE_API, {'chatbot': history})
+    finally:
+        session.close()
+
+
+def fetch_server_metrics(metrics_url):
+    # 서버 쪽 LLM 대기열 대기 시간(합계, 건수). 메트릭 서버가 꺼져 있으면 None
+    if not metrics_url:
+        return None
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=5) as response:
+            snapshot = json.loads(response.read())
+    except Exception:
+        return None
+    totals = {}
+    for histogram in snapshot['histograms']:
+        if histogram['name'] == 'queue_wait_seconds':
+            queue = histogram['labels'].get('queue')
+            totals[queue] = (histogram['sum'], histogram['count'])
+    return totals
+
+
+def server_queue_wait(before, after):
+    if before is None or after is None:
+        return None
+    waits = {}
+    for queue, (total, count) in after.items():
+        previous_total, previous_count = before.get(queue, (0.0, 0))
+        if count > previous_count:
+            waits[queue] = {
+                'count': count - previous_count,
+                'mean_ms': (total - previous_total) / (count - previous_count) * 1000,
+            }
+    return waits
+
+
+def distribution(values):
+    values = [value * 1000 for value in values]
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) if values else 0.0,
+        'p50_ms': percentile(values, 0.5),
+        'p95_ms': percentile(values, 0.95),
+        'p99_ms': percentile(values, 0.99),
+        'max_ms': max(values) if values else 0.0,
+    }
+
+
+def run_level(args, endpoints, concurrency):
+    result = LoadResult()
+    before = fetch_server_metrics(args.metrics_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_session, args.url, endpoints, result, args.style, args.turns, args.think_time,
+                                   args.evaluate_every, args.seed + concurrency * 1000 + index)
+                   for index in range(args.sessions or concurrency)]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                # 클라이언트 연결 자체에 실패한 세션
+                result.add('session', error=f"{type(e).__name__}: {e}")
+    elapsed = time.perf_counter() - started
+    after = fetch_server_metrics(args.metrics_url)
+
+    requests = sum(result.requests.values())
+    errors = sum(result.errors.values())
+    completed_turns = len(result.timings.get(CHAT_API, {}).get('latency', []))
+    return {
+        'concurrency': concurrency,
+        'sessions': args.sessions or concurrency,
+        'elapsed_seconds': elapsed,
+        'requests': requests,
+        'errors': errors,
+        'error_rate': errors / requests if requests else 0.0,
+        'throughput_turns_per_second': completed_turns / elapsed if elapsed else 0.0,
+        'throughput_requests_per_second': (requests - errors) / elapsed if elapsed else 0.0,
+        'endpoints': {
+            endpoint: {
+                'requests': result.requests.get(endpoint, 0),
+                'errors': result.errors.get(endpoint, 0),
+                'error_rate': result.errors.get(endpoint, 0) / result.requests[endpoint],
+                'throughput_requests_per_second':
+                    (result.requests[endpoint] - result.errors.get(endpoint, 0)) / elapsed if elapsed else 0.0,
+                **{name: distribution(result.timings.get(endpoint, {}).get(name, []))
+                   for name in ('latency', 'queue_wait', 'first_output')},
+            }
+            for endpoint in result.requests
+        },
+        'server_queue_wait': server_queue_wait(before, after),
+        'error_samples': result.error_samples,
+    }
+
+
+def launch_server(args):
+    # 가짜 LLM 백엔드로 앱을 띄움 (실제 API를 부르지 않고 지연 시간만 흉내 냄)
+    env = dict(os.environ)
+    env.update({
+        'LLM_BACKEND': args.backend,
+        'FAKE_LLM_FIRST_TOKEN_LATENCY': str(args.llm_first_token_latency),
+        'FAKE_LLM_TOKEN_LATENCY': str(args.llm_token_latency),
+        # 따로 지정하지 않으면 측정 중 만든 세션은 저장하지 않음
+        'SESSION_DB': env.get('SESSION_DB', ''),
+        **LAUNCH_RETRIEVAL_ENV,
+    })
+    # 색인이 없으면 만들고, 있으면 바뀐 문서만 다시 적재 (대부분 바로 끝남)
+    subprocess.run([sys.executable, 'ingest_empathy.py', '--backend', 'numpy',
+                    '--index-dir', LAUNCH_RETRIEVAL_ENV['EMPATHY_INDEX_DIR']],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+    process = subprocess.Popen([sys.executable, 'start_page.py'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + args.launch_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"앱이 시작되지 못하고 종료되었습니다 (종료 코드 {process.returncode})")
+        try:
+            with urllib.request.urlopen(args.url, timeout=2) as response:
+                response.read()
+            return process
+        except Exception:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"{args.launch_timeout:.0f}초 안에 앱이 준비되지 않았습니다: {args.url}")
+
+
+def format_report(report):
+    lines = [f"부하 테스트: {report['url']} (턴 {report['config']['turns']}회, 생각 시간 평균 {report['config']['think_time']}초)"]
+    header = f"{'동시성':>6} {'처리량(요청/s)':>13} {'오류율':>7} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'대기열 p95(ms)':>14} {'첫 출력 p95(ms)':>15}"
+    for endpoint in (CHAT_API, EVALUATE_API):
+        levels = [level for level in report['levels'] if endpoint in level['endpoints']]
+        if not levels:
+            continue
+        lines.append(f"\n[{endpoint}]")
+        lines.append(header)
+        for level in levels:
+            stats = level['endpoints'][endpoint]
+            lines.append(
+                f"{level['concurrency']:>6} {stats['throughput_requests_per_second']:>13.2f} {stats['error_rate']:>7.1%} "
+                f"{stats['latency']['p50_ms']:>9.1f} {stats['latency']['p95_ms']:>9.1f} {stats['latency']['p99_ms']:>9.1f} "
+                f"{stats['queue_wait']['p95_ms']:>14.1f} {stats['first_output']['p95_ms']:>15.1f}"
+            )
+    for level in report['levels']:
+        for sample in level['error_samples']:
+            lines.append(f"오류 예시 (동시성 {level['concurrency']}): {sample}")
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='실행 중인 앱의 대화/상담 API에 여러 세션을 동시에 열어 동시성별 지연 시간과 처리량을 측정합니다.')
+    parser.add_argument('--url', default=DEFAULT_URL, help='앱 주소')
+    parser.add_argument('--concurrency', default='1,4,16', help='쉼표로 구분한 동시 세션 수 단계')
+    parser.add_argument('--sessions', type=int, default=0, help='단계별 세션 수 (기본: 동시성과 같게)')
+    parser.add_argument('--turns', type=int, default=10, help='세션당 대화 턴 수')
+    parser.add_argument('--think-time', type=float, default=1.0, help='턴 사이 평균 생각 시간(초), 0~2배 사이에서 무작위')
+    parser.add_argument('--evaluate-every', type=int, default=1, help='몇 턴마다 상담사 평가를 요청할지 (0이면 요청하지 않음)')
+    parser.add_argument('--style', default='warm', help="부모 발화 생성기 (simulate.py의 스타일 이름 또는 'module:function')")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--metrics-url', default=DEFAULT_METRICS_URL, help='서버 쪽 대기열 통계를 읽을 주소 (빈 값이면 사용하지 않음)')
+    parser.add_argument('--launch', action='store_true', help='가짜 LLM 백엔드와 내장 검색 색인으로 앱을 직접 띄운 뒤 측정하고 종료')
+    parser.add_argument('--backend', default='fake', help='--launch 시 사용할 LLM 백엔드 (fake, replay)')
+    parser.add_argument('--llm-first-token-latency', type=float, default=0.2, help='--launch 시 가짜 LLM의 첫 토큰 지연(초)')
+    parser.add_argument('--llm-token-latency', type=float, default=0.01, help='--launch 시 가짜 LLM의 토큰당 지연(초)')
+    parser.add_argument('--launch-timeout', type=float, default=60)
+    parser.add_argument('--label', default='', help='보고서에 남길 릴리스 이름 (버전 간 비교용)')
+    parser.add_argument('--output', default='loadtest_report.json', help='JSON 보고서 경로')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    load_parent_generator(args.style)
+    process = launch_server(args) if args.launch else None
+    try:
+        endpoints = load_endpoints(args.url)
+        results = []
+        for concurrency in levels:
+            print(f"동시성 {concurrency} 측정 중...")
+            results.append(run_level(args, endpoints, concurrency))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    report = {
+        'label': args.label,
+        'commit': commit,
+        'url': args.url,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'config': {
+            'turns': args.turns,
+            'think_time': args.think_time,
+            'evaluate_every': args.evaluate_every,
+            'sessions': args.sessions,
+            'style': args.style,
+            'seed': args.seed,
+            'launched': args.launch,
+            'backend': args.backend if args.launch else None,
+            'retrieval': LAUNCH_RETRIEVAL_ENV if args.launch else None,
+        },
+        'levels': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(format_report(report))
+    print(f"보고서 저장: {args.output}")
+    return 1 if any(level['error_rate'] > 0 for level in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
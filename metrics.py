@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 메트릭 HTTP 엔드포인트 (로컬에서만 접근, METRICS_PORT를 빈 값으로 두면 사용하지 않음)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = os.environ.get('METRICS_PORT', '9100')
+
+# 세션별 JSON-lines 추적 로그를 남길 디렉터리 (빈 값이면 남기지 않음)
+TRACE_DIR = os.environ.get('TRACE_DIR', '')
+
+# 히스토그램 버킷 경계: 지연 시간(초), 토큰 수
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class Histogram:
+    # 누적 버킷 개수, 합계, 개수만 보관하는 고정 버킷 히스토그램
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+
+class MetricsRegistry:
+    # 이름과 라벨 조합별 히스토그램/카운터, 그리고 조회 시점에 통계를 읽어 오는 수집기를 보관
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def register_collector(self, name, collect):
+        # collect()는 {이름: 숫자 또는 dict} 형태의 현재 통계를 돌려줌 (예: 캐시 적중 수)
+        self._collectors[name] = collect
+
+    def _collect(self):
+        collected = {}
+        for name, collect in list(self._collectors.items()):
+            try:
+                collected[name] = collect()
+            except Exception as e:
+                collected[name] = {'error': str(e)}
+        return collected
+
+    def snapshot(self):
+        with self._lock:
+            histograms = [{'name': name, 'labels': dict(labels), **histogram.snapshot()}
+                          for (name, labels), histogram in self._histograms.items()]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self._counters.items()]
+        return {'histograms': histograms, 'counters': counters, 'collectors': self._collect()}
+
+    def render_text(self):
+        # Prometheus 텍스트 형식
+        snapshot = self.snapshot()
+        lines = []
+        for histogram in snapshot['histograms']:
+            labels = _format_labels(histogram['labels'])
+            for bound, count in histogram['buckets']:
+                lines.append(f"{histogram['name']}_bucket{_format_labels(histogram['labels'], le=bound)} {count}")
+            lines.append(f"{histogram['name']}_sum{labels} {histogram['sum']}")
+            lines.append(f"{histogram['name']}_count{labels} {histogram['count']}")
+        for counter in snapshot['counters']:
+            lines.append(f"{counter['name']}{_format_labels(counter['labels'])} {counter['value']}")
+        for name, stats in snapshot['collectors'].items():
+            for key, value in _flatten(stats):
+                if isinstance(value, (int, float)):
+                    lines.append(f"{name}{_format_labels({'stat': key})} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def _flatten(stats, prefix=''):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+metrics = MetricsRegistry()
+
+
+class TraceLog:
+    # 세션 id별 파일에 구간 기록을 한 줄씩 추가
+    def __init__(self, directory=TRACE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, session_id, record):
+        if not self.directory or session_id is None:
+            return
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        path = os.path.join(self.directory, f"{session_id}.jsonl")
+        with self._lock:
+            with open(path, 'a', encoding='utf-8') as file:
+                file.write(line)
+
+
+trace_log = TraceLog()
+
+
+@contextmanager
+def span(name, session_id=None, **attributes):
+    # 블록의 소요 시간을 span_seconds 히스토그램에 기록하고, 세션이 있으면 추적 로그에도 남김
+    # 블록 안에서 attributes에 값을 추가하면 추적 로그에 함께 기록됨
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield attributes
+    except BaseException as e:
+        status = 'cancelled' if isinstance(e, GeneratorExit) else 'error'
+        if status == 'error':
+            attributes['error'] = f"{type(e).__name__}: {e}"
+            metrics.increment('span_errors_total', span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('span_seconds', elapsed, span=name)
+        trace_log.write(session_id, {
+            'ts': time.time(), 'session': session_id, 'span': name,
+            'duration_ms': round(elapsed * 1000, 3), 'status': status, **attributes
+        })
+
+
+def record_error(name, session_id=None, error=None):
+    # UI에 문자열로 돌려주는 오류도 개수와 추적 로그로 남김
+    metrics.increment('handler_errors_total', handler=name)
+    trace_log.write(session_id, {
+        'ts': time.time(), 'session': session_id, 'span': name, 'status': 'error',
+        'error': f"{type(error).__name__}: {error}" if error is not None else None
+    })
+
+
+def observe_tokens(kind, count):
+    metrics.observe('llm_tokens', count, buckets=TOKEN_BUCKETS, kind=kind)
+
+
+def observe_queue_wait(queue_name, seconds):
+    metrics.observe('queue_wait_seconds', seconds, queue=queue_name)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body = json.dumps(metrics.snapshot(), ensure_ascii=False, default=str).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        elif self.path.startswith('/metrics'):
+            body = metrics.render_text().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    # /metrics (Prometheus 텍스트)와 /metrics.json을 제공하는 서버를 한 번만 띄움
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError as e:
+                print(f"메트릭 서버를 시작할 수 없습니다: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+    return _server
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+
+# 벡터 행렬, 메타데이터, (선택) IVF 군집 정보를 버전 디렉터리 하나에 저장하고,
+# CURRENT 파일이 현재 버전 디렉터리 이름을 가리킴
+INDEX_DIR = 'empathy_index'
+VECTORS_NAME = 'vectors.npy'
+SCALES_NAME = 'scales.npy'
+CENTROIDS_NAME = 'centroids.npy'
+META_NAME = 'meta.json'
+CURRENT_NAME = 'CURRENT'
+VERSION_PREFIX = 'v-'
+# 새 버전을 만든 뒤에도 남겨 둘 이전 버전 수 (아직 열려 있는 색인이 읽을 수 있도록)
+KEEP_VERSIONS = 1
+
+# 한 번에 점수를 계산할 행 수 (float32 변환 메모리를 제한)
+SCORE_BLOCK = 4096
+# 조건에 맞는 행의 비율이 이보다 작으면 전체 구간 대신 해당 행만 골라서 점수 계산
+SPARSE_MASK_RATIO = 0.25
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _kmeans(vectors, nlist, iterations=10, seed=0):
+    # 단순 Lloyd 알고리즘 (코사인 유사도 기준)
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)]
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(nlist):
+            members = vectors[assign == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+def resolve_index_dir(index_dir=INDEX_DIR):
+    # CURRENT가 가리키는 버전 디렉터리 (CURRENT가 없으면 예전처럼 index_dir에 바로 저장된 색인)
+    try:
+        with open(os.path.join(index_dir, CURRENT_NAME), 'r', encoding='utf-8') as file:
+            return os.path.join(index_dir, file.read().strip())
+    except FileNotFoundError:
+        return index_dir
+
+
+def _publish(index_dir, version_dir):
+    # 포인터 파일 교체가 유일한 공개 시점: 읽는 쪽은 이전 버전 전체 또는 새 버전 전체만 봄
+    tmp_path = os.path.join(index_dir, f"{CURRENT_NAME}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(os.path.basename(version_dir))
+    os.replace(tmp_path, os.path.join(index_dir, CURRENT_NAME))
+
+    # 오래된 버전 정리 (메모리 매핑 중인 파일은 삭제해도 매핑이 끝날 때까지 유지됨)
+    versions = sorted(name for name in os.listdir(index_dir)
+                      if name.startswith(VERSION_PREFIX) and name != os.path.basename(version_dir))
+    for name in versions[:max(0, len(versions) - KEEP_VERSIONS)]:
+        shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+
+def build_index(ids, embeddings, metadatas, index_dir=INDEX_DIR, dtype='float16', nlist=0):
+    vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+    ids = list(ids)
+    metadatas = list(metadatas)
+    offsets = None
+
+    # IVF: 같은 군집의 행이 연속되도록 재배열해서 군집 하나를 한 구간으로 읽을 수 있게 함
+    if nlist and len(vectors) > nlist:
+        centroids, assign = _kmeans(vectors, nlist)
+        order = np.argsort(assign, kind='stable')
+        vectors = vectors[order]
+        ids = [ids[i] for i in order]
+        metadatas = [metadatas[i] for i in order]
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).tolist()
+    else:
+        centroids = None
+
+    # 모든 파일을 임시 디렉터리에 쓴 뒤 버전 디렉터리로 이름을 바꾸고, 마지막에 CURRENT를 교체
+    # (기존 파일을 덮어쓰지 않으므로 읽는 중인 색인이나 중간에 멈춘 빌드가 서로 섞이지 않음)
+    os.makedirs(index_dir, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix='build-', dir=index_dir)
+    try:
+        if dtype == 'int8':
+            # 행마다 대칭 스케일을 두고 int8로 양자화
+            scales = np.abs(vectors).max(axis=1)
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None] * 127).astype(np.int8)
+            np.save(os.path.join(build_dir, VECTORS_NAME), quantized)
+            np.save(os.path.join(build_dir, SCALES_NAME), (scales / 127).astype(np.float32))
+        else:
+            np.save(os.path.join(build_dir, VECTORS_NAME), vectors.astype(np.float16))
+
+        if centroids is not None:
+            np.save(os.path.join(build_dir, CENTROIDS_NAME), centroids.astype(np.float32))
+
+        with open(os.path.join(build_dir, META_NAME), 'w', encoding='utf-8') as file:
+            json.dump({'ids': ids, 'metadatas': metadatas, 'dtype': dtype, 'offsets': offsets}, file, ensure_ascii=False)
+
+        version_dir = os.path.join(index_dir, f"{VERSION_PREFIX}{time.time_ns():020d}-{os.getpid()}")
+        os.rename(build_dir, version_dir)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    _publish(index_dir, version_dir)
+    return version_dir
+
+
+class NumpyVectorIndex:
+    # Chroma 컬렉션의 query()와 같은 형태로 결과를 돌려주는 내장 벡터 색인
+    def __init__(self, index_dir=INDEX_DIR, nprobe=4):
+        index_dir = resolve_index_dir(index_dir)
+        with open(os.path.join(index_dir, META_NAME), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        self.ids = meta['ids']
+        self.metadatas = meta['metadatas']
+        self.offsets = meta['offsets']
+        self.nprobe = nprobe
+
+        # 행렬은 메모리 매핑으로 열어 필요한 구간만 읽음
+        self.vectors = np.load(os.path.join(index_dir, VECTORS_NAME), mmap_mode='r')
+        self.scales = np.load(os.path.join(index_dir, SCALES_NAME)) if meta['dtype'] == 'int8' else None
+        self.centroids = np.load(os.path.join(index_dir, CENTROIDS_NAME)) if self.offsets else None
+        self._masks = {}
+        self._rows = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _mask(self, where):
+        # where 조건(필드 == 값, 또는 Chroma 형식의 {'$and': [...]})별 행 마스크는 한 번만 계산해서 재사용
+        if not where:
+            return None
+        conditions = {}
+        for condition in where.get('$and', [where]):
+            conditions.update(condition)
+        key = tuple(sorted(conditions.items()))
+        if key not in self._masks:
+            self._masks[key] = np.array([all(metadata.get(field) == value for field, value in conditions.items())
+                                         for metadata in self.metadatas], dtype=bool)
+        return self._masks[key]
+
+    def _candidate_ranges(self, query):
+        if self.centroids is None:
+            return [(0, len(self.ids))]
+        nprobe = min(self.nprobe, len(self.centroids))
+        clusters = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return [(self.offsets[c], self.offsets[c + 1]) for c in sorted(clusters)]
+
+    def _score(self, start, end, query):
+        scores = np.empty(end - start, dtype=np.float32)
+        for block in range(start, end, SCORE_BLOCK):
+            block_end = min(block + SCORE_BLOCK, end)
+            scores[block - start:block_end - start] = self.vectors[block:block_end].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[start:end]
+        return scores
+
+    def _score_rows(self, rows, query):
+        scores = np.empty(len(rows), dtype=np.float32)
+        for block in range(0, len(rows), SCORE_BLOCK):
+            block_rows = rows[block:block + SCORE_BLOCK]
+            scores[block:block + len(block_rows)] = self.vectors[block_rows].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        return scores
+
+    def search(self, query_embedding, k, where=None):
+        query = _normalize(np.asarray([query_embedding], dtype=np.float32))[0]
+        mask = self._mask(where)
+
+        rows, scores = [], []
+        for start, end in self._candidate_ranges(query):
+            if mask is not None and mask[start:end].mean() < SPARSE_MASK_RATIO:
+                # 조건에 맞는 행이 적으면(예: 감정 분류 하나) 그 행들만 골라서 계산
+                block_rows = start + np.flatnonzero(mask[start:end])
+                block_scores = self._score_rows(block_rows, query)
+            else:
+                block_rows = np.arange(start, end)
+                block_scores = self._score(start, end, query)
+                if mask is not None:
+                    keep = mask[start:end]
+                    block_rows, block_scores = block_rows[keep], block_scores[keep]
+            rows.append(block_rows)
+            scores.append(block_scores)
+
+        rows = np.concatenate(rows)
+        scores = np.concatenate(scores)
+        if len(rows) == 0:
+            return [], []
+
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top].tolist(), scores[top].tolist()
+
+    def score_ids(self, query_embedding, doc_ids):
+        # 주어진 문서들만 점수 계산 (어휘 색인으로 추린 후보를 재정렬할 때 사용)
+        if self._rows is None:
+            self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        found = [doc_id for doc_id in doc_ids if doc_id in self._rows]
+        if not found:
+            return [], []
+        query = _normalize(np.asarray([query_embedding], dtype=np.float32))[0]
+        rows = np.array([self._rows[doc_id] for doc_id in found])
+        order = np.argsort(rows)
+        scores = np.empty(len(rows), dtype=np.float32)
+        # 메모리 매핑된 행렬을 앞에서부터 읽도록 행 번호 순서로 가져옴
+        scores[order] = self.vectors[rows[order]].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        return found, scores.tolist()
+
+    def query(self, query_embeddings, n_results, where=None, include=None):
+        result = {'ids': [], 'metadatas': [], 'distances': []}
+        for query_embedding in query_embeddings:
+            rows, scores = self.search(query_embedding, n_results, where)
+            result['ids'].append([self.ids[row] for row in rows])
+            result['metadatas'].append([self.metadatas[row] for row in rows])
+            # Chroma와 같이 작을수록 가까운 거리로 변환
+            result['distances'].append([1.0 - score for score in scores])
+        return result
+
+    def vectors_by_id(self):
+        # 증분 재구성용: 기존 색인의 (정규화된) 벡터를 id별로 돌려줌
+        vectors = np.asarray(self.vectors, dtype=np.float32)
+        if self.scales is not None:
+            vectors = vectors * self.scales[:, None]
+        return {doc_id: vectors[row] for row, doc_id in enumerate(self.ids)}
@@ -0,0 +1,103 @@
+import os
+import atexit
+import threading
+
+# 변경된 페르소나를 파일로 내보내는 주기(초)
+FLUSH_INTERVAL = 2.0
+
+
+def parse_persona(lines):
+    persona = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        key, value = line.split(': ', 1)
+        persona[key] = value
+    return persona
+
+
+def format_persona(persona):
+    return ''.join(f"{key}: {value}\n" for key, value in persona.items())
+
+
+class PersonaRepository:
+    # 페르소나를 파일 경로별로 메모리에 보관하고, 변경분은 백그라운드에서 모아서 저장합니다.
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._personas = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='persona-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def load(self, persona_file):
+        with self._lock:
+            if persona_file in self._personas:
+                return dict(self._personas[persona_file])
+
+        persona = {}
+        try:
+            with open(persona_file, 'r', encoding='utf-8') as file:
+                persona = parse_persona(file)
+        except FileNotFoundError:
+            print(f"{persona_file} 파일을 찾을 수 없습니다.")
+            return persona
+        except Exception as e:
+            print(f"페르소나 로드 중 오류 발생: {e}")
+            return persona
+
+        with self._lock:
+            self._personas.setdefault(persona_file, persona)
+            return dict(self._personas[persona_file])
+
+    def save(self, persona_file, persona):
+        # 메모리만 갱신하고 즉시 반환 (파일 쓰기는 writer 스레드가 담당)
+        with self._lock:
+            self._personas[persona_file] = dict(persona)
+            self._dirty.add(persona_file)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = {persona_file: dict(self._personas[persona_file]) for persona_file in self._dirty}
+                self._dirty.clear()
+
+            for persona_file, persona in batch.items():
+                try:
+                    self._write(persona_file, persona)
+                except Exception as e:
+                    print(f"페르소나 저장 중 오류 발생: {e}")
+                    with self._lock:
+                        self._dirty.add(persona_file)
+
+    @staticmethod
+    def _write(persona_file, persona):
+        # 임시 파일에 모두 쓴 뒤 교체해서, 중간에 멈춰도 반쯤 쓰인 파일이 남지 않도록 함
+        os.makedirs(os.path.dirname(persona_file) or '.', exist_ok=True)
+        tmp_path = f"{persona_file}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(format_persona(persona))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, persona_file)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        if not self._stopped:
+            self._stopped = True
+            self._wakeup.set()
+            self._thread.join(timeout=self.flush_interval + 1)
+            self.flush()
+
+
+persona_store = PersonaRepository()
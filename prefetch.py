@@ -0,0 +1,74 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from metrics import observe_queue_wait
+
+# 동시에 미리 계산할 작업 수와 보관할 결과 수
+PREFETCH_WORKERS = 4
+PREFETCH_CAPACITY = 512
+
+
+class PrefetchExecutor:
+    # 턴 id별로 미리 계산한 결과를 보관하는 백그라운드 작업 실행기
+    def __init__(self, max_workers=PREFETCH_WORKERS, capacity=PREFETCH_CAPACITY):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, turn_id, fn, *args, **kwargs):
+        # 같은 턴 id로 이미 시작한 작업이 있으면 다시 시작하지 않음
+        with self._lock:
+            future = self._futures.get(turn_id)
+            if future is not None and not future.cancelled():
+                return future
+            future = self._executor.submit(fn, *args, **kwargs)
+            self._futures[turn_id] = future
+            while len(self._futures) > self.capacity:
+                _, evicted = self._futures.popitem(last=False)
+                evicted.cancel()
+            return future
+
+    def get(self, turn_id, compute=None, timeout=None):
+        # 미리 계산된(또는 계산 중인) 결과가 있으면 그것을, 없으면 compute()로 바로 계산
+        with self._lock:
+            future = self._futures.get(turn_id)
+        if future is not None:
+            try:
+                waited = time.perf_counter()
+                result = future.result(timeout=timeout)
+                # 아직 계산 중이던 작업을 기다린 시간
+                observe_queue_wait('prefetch', time.perf_counter() - waited)
+                self.hits += 1
+                return result
+            except CancelledError:
+                pass
+            except Exception as e:
+                # 미리 계산하다 실패한 작업은 호출한 쪽으로 예외를 넘기지 않고 바로 다시 계산
+                print(f"미리 계산한 작업 실패, 다시 계산합니다: {turn_id}: {e}")
+        self.misses += 1
+        return compute() if compute is not None else None
+
+    def cancel(self, turn_id):
+        with self._lock:
+            future = self._futures.pop(turn_id, None)
+        return future.cancel() if future is not None else False
+
+    def cancel_matching(self, predicate):
+        # 예: 세션을 초기화할 때 그 세션의 턴 id에 해당하는 작업을 모두 취소
+        with self._lock:
+            turn_ids = [turn_id for turn_id in self._futures if predicate(turn_id)]
+            futures = [self._futures.pop(turn_id) for turn_id in turn_ids]
+        for future in futures:
+            future.cancel()
+        return len(futures)
+
+    def stats(self):
+        return {'size': len(self._futures), 'hits': self.hits, 'misses': self.misses}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,45 @@
+from langchain_core.messages import SystemMessage, HumanMessage
+
+from cache import LRUCache
+
+# 페르소나 항목 중 매 턴 바뀌는 값 (고정 접두부에 넣지 않음)
+DYNAMIC_PERSONA_KEYS = ('age', 'conversation_count')
+
+
+def persona_key(persona):
+    return tuple(sorted((key, str(value)) for key, value in persona.items() if key not in DYNAMIC_PERSONA_KEYS))
+
+
+def dedupe_system_messages(messages):
+    # 내용이 같은 시스템 메시지는 처음 한 번만 남김
+    seen = set()
+    deduped = []
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            if message.content in seen:
+                continue
+            seen.add(message.content)
+        deduped.append(message)
+    return deduped
+
+
+class PromptEngine:
+    # (페르소나, 단계)별 고정 시스템 프롬프트를 한 번만 만들어 두고,
+    # 항상 [고정 접두부, 이전 대화, 이번 턴 맥락, 사용자 입력] 순서로 메시지를 배치합니다.
+    # 접두부가 턴마다 동일하므로 제공자 측 프롬프트 캐시가 적중할 수 있습니다.
+    def __init__(self, build_static, cache_size=256):
+        self.build_static = build_static
+        self.cache = LRUCache(cache_size)
+
+    def static_message(self, persona, stage):
+        key = (persona_key(persona), stage)
+        return self.cache.get_or_compute(key, lambda: SystemMessage(content=self.build_static(persona, stage)))
+
+    def build(self, persona, stage, user_input, context=None, history_messages=()):
+        messages = [self.static_message(persona, stage)]
+        messages.extend(dedupe_system_messages(history_messages))
+        if context:
+            messages.append(SystemMessage(content=context))
+        messages.append(HumanMessage(content=user_input))
+        return messages
+
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import zlib
+import atexit
+import sqlite3
+import threading
+
+# 세션 기록 DB 경로 (SESSION_DB를 빈 값으로 두면 저장하지 않음)
+SESSION_DB = os.environ.get('SESSION_DB', 'sessions.db')
+
+# 마지막 기록 후 이 시간(초)이 지난 세션은 기록을 스냅샷 하나로 합침
+COMPACT_AFTER = float(os.environ.get('SESSION_COMPACT_AFTER', str(24 * 60 * 60)))
+COMPACT_INTERVAL = 10 * 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    persona TEXT NOT NULL,
+    seed INTEGER,
+    state TEXT,
+    status TEXT NOT NULL DEFAULT 'active',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_records (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (status, updated_at);
+'''
+
+# 스냅샷 기록의 종류 (여러 기록을 압축해 합친 것)
+SNAPSHOT = 'snapshot'
+
+
+def _encode(kind, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return zlib.compress(data) if kind == SNAPSHOT else data
+
+
+def _decode(kind, payload):
+    data = zlib.decompress(payload) if kind == SNAPSHOT else payload
+    return json.loads(data)
+
+
+class SessionStore:
+    # 세션마다 대화 한 턴, 이벤트, 나이 변화를 작은 행 하나로 추가만 하는 SQLite(WAL) 저장소
+    # 대화 기록 전체를 다시 쓰지 않으며, 오래된 세션은 백그라운드에서 스냅샷 하나로 합칩니다.
+    def __init__(self, path=SESSION_DB, compact_after=COMPACT_AFTER, compact_interval=COMPACT_INTERVAL):
+        self.path = path
+        self.compact_after = compact_after
+        self.compact_interval = compact_interval
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # WAL에서는 NORMAL로도 커밋 순서가 보장되고 쓰기마다 fsync하지 않음
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._next_seq = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='session-compactor', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def create(self, session_id, persona, seed=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO sessions (session_id, persona, seed, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (session_id, json.dumps(persona, ensure_ascii=False), seed, now, now)
+            )
+
+    def _seq(self, session_id):
+        seq = self._next_seq.get(session_id)
+        if seq is None:
+            row = self._conn.execute('SELECT MAX(seq) FROM session_records WHERE session_id = ?', (session_id,)).fetchone()
+            seq = (row[0] or 0) + 1
+        self._next_seq[session_id] = seq + 1
+        return seq
+
+    def append(self, session_id, kind, payload, state=None):
+        # 기록 한 줄 추가 + 세션의 최신 상태(카운터, 나이 등 작은 값)만 갱신
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.execute(
+                    'INSERT INTO session_records (session_id, seq, kind, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (session_id, self._seq(session_id), kind, _encode(kind, payload), now)
+                )
+                if state is None:
+                    self._conn.execute('UPDATE sessions SET updated_at = ? WHERE session_id = ?', (now, session_id))
+                else:
+                    self._conn.execute(
+                        "UPDATE sessions SET state = ?, updated_at = ?, status = 'active' WHERE session_id = ?",
+                        (json.dumps(state, ensure_ascii=False), now, session_id)
+                    )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                self._next_seq.pop(session_id, None)
+                raise
+
+    def mark_saved(self, session_id):
+        with self._lock:
+            self._conn.execute("UPDATE sessions SET status = 'saved', updated_at = ? WHERE session_id = ?",
+                               (time.time(), session_id))
+
+    def load(self, session_id):
+        # 페르소나, 시드, 최신 상태와 순서대로 정렬된 기록 목록 (스냅샷은 풀어서 펼침)
+        with self._lock:
+            row = self._conn.execute('SELECT persona, seed, state, status FROM sessions WHERE session_id = ?',
+                                     (session_id,)).fetchone()
+            if row is None:
+                return None
+            records = self._conn.execute(
+                'SELECT kind, payload FROM session_records WHERE session_id = ? ORDER BY seq', (session_id,)
+            ).fetchall()
+
+        entries = []
+        for kind, payload in records:
+            if kind == SNAPSHOT:
+                entries.extend(_decode(kind, payload))
+            else:
+                entries.append({'kind': kind, **_decode(kind, payload)})
+        return {
+            'session_id': session_id,
+            'persona': json.loads(row[0]),
+            'seed': row[1],
+            'state': json.loads(row[2]) if row[2] else None,
+            'status': row[3],
+            'entries': entries,
+        }
+
+    def compact(self, session_id):
+        # 세션의 기록을 압축된 스냅샷 한 줄로 바꿈 (한 트랜잭션 안에서 수행)
+        with self._lock:
+            records = self._conn.execute(
+                'SELECT seq, kind, payload FROM session_records WHERE session_id = ? ORDER BY seq', (session_id,)
+            ).fetchall()
+            if len(records) <= 1:
+                return False
+            entries = []
+            for _, kind, payload in records:
+                if kind == SNAPSHOT:
+                    entries.extend(_decode(kind, payload))
+                else:
+                    entries.append({'kind': kind, **_decode(kind, payload)})
+            last_seq = records[-1][0]
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.execute('DELETE FROM session_records WHERE session_id = ? AND seq <= ?', (session_id, last_seq))
+                self._conn.execute(
+                    'INSERT INTO session_records (session_id, seq, kind, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (session_id, last_seq, SNAPSHOT, _encode(SNAPSHOT, entries), time.time())
+                )
+                self._conn.execute("UPDATE sessions SET status = 'compacted' WHERE session_id = ?", (session_id,))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return True
+
+    def compact_old(self):
+        cutoff = time.time() - self.compact_after
+        with self._lock:
+            session_ids = [row[0] for row in self._conn.execute(
+                "SELECT session_id FROM sessions WHERE status != 'compacted' AND updated_at < ?", (cutoff,)
+            )]
+        compacted = sum(1 for session_id in session_ids if self.compact(session_id))
+        if compacted:
+            with self._lock:
+                self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return compacted
+
+    def _run(self):
+        while not self._stopped.wait(self.compact_interval):
+            try:
+                self.compact_old()
+            except Exception as e:
+                print(f"세션 기록 정리 중 오류 발생: {e}")
+
+    def close(self):
+        if not self._stopped.is_set():
+            self._stopped.set()
+            with self._lock:
+                self._conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    # SESSION_DB가 빈 값이면 None (저장하지 않음)
+    global _store
+    if _store is None and SESSION_DB:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import importlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# 시뮬레이션은 기본적으로 가짜 LLM으로 실행 (실제 API를 쓰려면 --backend openai)
+DEFAULT_BACKEND = 'fake'
+DEFAULT_MAX_TURNS = 200
+
+DEFAULT_PERSONAS = [
+    {'name': '민준', 'age': '5', 'gender': '남성', 'role': '아들', 'personality': '활발하고 호기심이 많은',
+     'hobbies': '축구와 레고', 'speaking_style': '밝고 솔직한 말투', 'parent_role': '아빠'},
+    {'name': '서연', 'age': '5', 'gender': '여성', 'role': '딸', 'personality': '조용하고 섬세한',
+     'hobbies': '그림 그리기', 'speaking_style': '차분하고 조심스러운 말투', 'parent_role': '엄마'},
+    {'name': '지호', 'age': '8', 'gender': '남성', 'role': '아들', 'personality': '고집이 세고 솔직한',
+     'hobbies': '게임', 'speaking_style': '툭툭 던지는 말투', 'parent_role': '엄마'},
+]
+
+
+def _pick(lines, rng):
+    return rng.choice(lines)
+
+
+def warm_parent(history, session, rng):
+    return _pick([
+        "오늘 하루는 어땠어?",
+        "그랬구나. 그때 기분이 어땠어?",
+        "네 이야기를 들려줘서 고마워.",
+        "힘들었겠다. 엄마 아빠는 항상 네 편이야.",
+        "어떻게 하면 좋을지 같이 생각해 볼까?",
+    ], rng)
+
+
+def strict_parent(history, session, rng):
+    return _pick([
+        "숙제는 다 했니?",
+        "그렇게 하면 안 된다고 했잖아.",
+        "변명하지 말고 다음부터 잘해.",
+        "왜 또 그랬어?",
+        "일찍 자야 내일 안 피곤하지.",
+    ], rng)
+
+
+def brief_parent(history, session, rng):
+    return _pick(["응.", "그래.", "알았어.", "좋네.", "그렇구나."], rng)
+
+
+def reflective_parent(history, session, rng):
+    # 아이의 마지막 말을 되짚어 주는 공감형 부모
+    last_reply = history[-1][1] if history else ''
+    if not last_reply or history[-1][0] == 'system':
+        return warm_parent(history, session, rng)
+    return f"'{last_reply[:30]}'라고 느꼈구나. 조금 더 이야기해 줄래?"
+
+
+PARENT_STYLES = {
+    'warm': warm_parent,
+    'strict': strict_parent,
+    'brief': brief_parent,
+    'reflective': reflective_parent,
+}
+
+
+def load_parent_generator(spec):
+    # 기본 스타일 이름 또는 'module:function' 형식 (함수는 (history, session, rng) -> 부모 발화)
+    if spec in PARENT_STYLES:
+        return PARENT_STYLES[spec]
+    module_name, _, function_name = spec.partition(':')
+    if not function_name:
+        raise ValueError(f"알 수 없는 부모 발화 생성기: {spec}")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def job_id(persona_index, style, seed):
+    return f"p{persona_index}-{style}-s{seed}"
+
+
+def _init_worker(backend):
+    # 각 작업 프로세스에서 한 번만 실행: 백엔드 설정 후 대화 로직을 불러옴
+    os.environ['LLM_BACKEND'] = backend
+    os.environ.setdefault('PREFETCH_COUNSELOR', '0')
+    os.environ.setdefault('SESSION_DB', '')
+    import display_interface  # noqa: F401
+
+
+def run_session(job):
+    import display_interface
+
+    started = time.perf_counter()
+    persona = job['persona']
+    generate = load_parent_generator(job['style'])
+    rng = random.Random(job['seed'])
+
+    session = display_interface.ChatSession(persona, seed=job['seed'])
+    timeline = {age: event['name'] for age, event in session.events.timeline.items()}
+
+    history = []
+    age = float(persona['age'])
+    error = None
+    for _ in range(job['max_turns']):
+        parent_message = generate(history, session, rng)
+        outputs = None
+        for outputs in display_interface.chat_langchain(parent_message, history, session):
+            pass
+        message, history, _, _, age, session = outputs
+        if message.startswith('Error:'):
+            error = message
+            break
+        if float(age) >= 20:
+            break
+
+    return {
+        'job_id': job['job_id'],
+        'persona_index': job['persona_index'],
+        'style': job['style'],
+        'seed': job['seed'],
+        'persona': persona,
+        'event_timeline': timeline,
+        'final_age': float(age),
+        'turns': len(history),
+        'history': history,
+        'error': error,
+        'elapsed': time.perf_counter() - started,
+    }
+
+
+def load_completed(path):
+    # 이미 끝난 작업 id (마지막 줄이 쓰다 만 상태면 무시하고 그 작업은 다시 실행)
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            try:
+                completed.add(json.loads(line)['job_id'])
+            except (ValueError, KeyError):
+                continue
+    return completed
+
+
+def open_output(path):
+    # 쓰다 만 줄 뒤에 이어 쓰지 않도록 줄바꿈으로 끝나게 맞춘 뒤 추가 모드로 엶
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            ends_with_newline = file.read(1) == b'\n'
+        if not ends_with_newline:
+            with open(path, 'a', encoding='utf-8') as file:
+                file.write('\n')
+    return open(path, 'a', encoding='utf-8')
+
+
+def build_jobs(personas, styles, seeds, max_turns):
+    jobs = []
+    for (persona_index, persona), style, seed in itertools.product(enumerate(personas), styles, seeds):
+        jobs.append({
+            'job_id': job_id(persona_index, style, seed),
+            'persona_index': persona_index,
+            'persona': persona,
+            'style': style,
+            'seed': seed,
+            'max_turns': max_turns,
+        })
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gradio 화면 없이 (페르소나 × 부모 스타일 × 이벤트 시드) 대화 세션을 여러 프로세스로 시뮬레이션합니다.')
+    parser.add_argument('--output', default='simulations.jsonl', help='세션별 결과를 한 줄씩 추가할 JSONL 경로')
+    parser.add_argument('--personas', help='페르소나 목록 JSON 파일 (기본: 내장 페르소나)')
+    parser.add_argument('--styles', default=','.join(PARENT_STYLES),
+                        help="쉼표로 구분한 부모 발화 생성기 (기본 스타일 이름 또는 'module:function')")
+    parser.add_argument('--seeds', type=int, default=10, help='조합마다 실행할 이벤트 시드 개수')
+    parser.add_argument('--seed-start', type=int, default=0)
+    parser.add_argument('--max-turns', type=int, default=DEFAULT_MAX_TURNS, help='세션당 최대 턴 수')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--backend', default=DEFAULT_BACKEND, help='LLM 백엔드 (openai, fake, record, replay)')
+    parser.add_argument('--fresh', action='store_true', help='기존 결과를 무시하고 처음부터 다시 실행')
+    args = parser.parse_args()
+
+    personas = DEFAULT_PERSONAS
+    if args.personas:
+        with open(args.personas, 'r', encoding='utf-8') as file:
+            personas = json.load(file)
+    styles = [style.strip() for style in args.styles.split(',') if style.strip()]
+    for style in styles:
+        load_parent_generator(style)
+    seeds = range(args.seed_start, args.seed_start + args.seeds)
+
+    if args.fresh and os.path.exists(args.output):
+        os.remove(args.output)
+    completed = load_completed(args.output)
+    jobs = [job for job in build_jobs(personas, styles, seeds, args.max_turns) if job['job_id'] not in completed]
+    print(f"전체 {len(jobs) + len(completed)}개 중 완료 {len(completed)}개, 남은 작업 {len(jobs)}개")
+    if not jobs:
+        return 0
+
+    started = time.perf_counter()
+    failed = 0
+    with open_output(args.output) as output, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.backend,)) as executor:
+        futures = {executor.submit(run_session, job): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # 기록하지 않은 작업은 다음 실행에서 다시 시도됨
+                failed += 1
+                print(f"[{done}/{len(jobs)}] {job['job_id']} 실패: {e}")
+                continue
+            # 끝나는 대로 한 줄씩 기록해서 중단되어도 이어서 실행할 수 있게 함
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+            print(f"[{done}/{len(jobs)}] {job['job_id']} {result['turns']}턴, 최종 나이 {result['final_age']}, {result['elapsed']:.1f}초")
+
+    print(f"완료: {len(jobs) - failed}개, 실패: {failed}개, {time.perf_counter() - started:.1f}초")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
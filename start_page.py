@@ -1,19 +1,23 @@
 # start_page.py
 
+# 시작 시간 측정을 위해 가장 먼저 불러옴
+from startup import start_background_warmup, report_first_page
 import os
-import webbrowser
 import threading
 import gradio as gr
 import random
-import json
-from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-from langchain_community.chat_models import ChatOpenAI
-from langchain.schema import AIMessage
-from langchain.memory import ConversationBufferMemory
 import traceback
-from langchain_core.messages import SystemMessage
-
-from display_interface import app2
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+from display_interface import app2, CONCURRENCY_LIMIT, persona_state, session_state, reset_outputs
+from display_interface import counseling_bot_reset as reset_chat_session
+from avatar import cache_header_middleware
+from event_catalog import get_catalog
+from persona_store import persona_store
+from prompt_engine import PromptEngine
+from llm_client import get_llm_pool
+from metrics import span, record_error, observe_tokens, start_metrics_server
+from conversation_memory import count_tokens
 
 # 환경 변수로 OpenAI API 키 설정
 os.environ['OPENAI_API_KEY'] = 'your_api_key'
@@ -31,36 +35,46 @@ def get_stage_prompt(age):
     else:
         return "성인"
 
-systemmsg_template = '''당신은 {name}, {age}세, {gender}인 {role}입니다. 당신은 {stage}입니다.
+# 나이는 매 턴 바뀌므로 고정 프롬프트에서 빼고 턴 맥락으로 전달
+systemmsg_template = '''당신은 {name}, {gender}인 {role}입니다. 당신은 {stage}입니다.
 성격은 {personality}. 취미는 {hobbies}. 말투는 {speaking_style}. 사용자(부모님)는 {parent_role}입니다.
 '''
-system_prompt = SystemMessagePromptTemplate.from_template(systemmsg_template)
-
-humanmsg = '{text}'
-human_prompt = HumanMessagePromptTemplate.from_template(humanmsg)
-
-chat_prompt = ChatPromptTemplate.from_messages([system_prompt, human_prompt])
-llm = ChatOpenAI(model_name='gpt-4o')
-
-memory = ConversationBufferMemory(return_messages=True)
-
-def load_events():
-    with open('events.json', 'r', encoding='utf-8') as file:
-        return json.load(file)
-
-events = load_events()
-
-def get_next_event(age, history):
-    possible_events = [event for event in events['random_events'] if event['min_age'] <= age and event['name'] not in [h[0] for h in history]]
-    if not possible_events:
-        return None
-    return random.choice(possible_events)
 
-def get_common_event(age, history):
-    for event in events['common_events']:
-        if event['age'] == age and event['name'] not in [h[0] for h in history]:
-            return event
-    return None
+def build_system_prompt(persona, stage):
+    return systemmsg_template.format(
+        name=persona['name'],
+        gender=persona['gender'],
+        role=persona['role'],
+        stage=stage,
+        personality=persona['personality'],
+        hobbies=persona['hobbies'],
+        speaking_style=persona['speaking_style'],
+        parent_role=persona['parent_role']
+    )
+
+prompt_engine = PromptEngine(build_system_prompt)
+CHILD_MODEL = 'gpt-4o'
+
+memory = None
+memory_lock = threading.Lock()
+
+def get_memory():
+    # langchain은 불러오는 데 오래 걸리므로 첫 대화 때 만듦 (보통은 시작 후 미리 준비됨)
+    global memory
+    if memory is None:
+        with memory_lock:
+            if memory is None:
+                from langchain.memory import ConversationBufferMemory
+                memory = ConversationBufferMemory(return_messages=True)
+    return memory
+
+def get_next_event(age, fired):
+    with span('event_lookup', age=age):
+        return get_catalog().next_event(age, set(fired))
+
+def get_common_event(age, fired):
+    with span('event_lookup', age=age):
+        return get_catalog().common_event(age, set(fired))
 
 def start_puberty_event():
     return """
@@ -74,6 +88,7 @@ def end_puberty_event():
 
 def counseling_bot_chat(message, persona, chat_history):
     global introduction_complete
+    memory = get_memory()
     try:
         if 'conversation_count' not in chat_history:
             chat_history['conversation_count'] = 0
@@ -91,9 +106,12 @@ def counseling_bot_chat(message, persona, chat_history):
             memory.chat_memory.add_messages([SystemMessage(content=intro_message)])
             chat_history['history'].append(["system", intro_message])
             chat_history['introduced'] = True
-            # 상황 부여
-            age, chat_history['history'], _ = app2.handle_event(chat_history['age'], chat_history['history'])
-            chat_history['age'] = age
+            # 상황 부여 (app2는 Blocks라 handle_event가 없으므로 이 화면의 이벤트 목록을 사용)
+            event = get_common_event(chat_history['age'], chat_history['event_history']) or get_next_event(chat_history['age'], chat_history['event_history'])
+            if event:
+                memory.chat_memory.add_messages([SystemMessage(content=event['description'])])
+                chat_history['event_history'].append(event['name'])
+                chat_history['history'].append(["system", event['description']])
 
         chat_history['conversation_count'] += 1
 
@@ -119,42 +137,38 @@ def counseling_bot_chat(message, persona, chat_history):
                 chat_history['event_history'].append(common_event['name'])
                 chat_history['history'].append(["system", event_message])
             else:
+                # 해당 나이에 고를 수 있는 이벤트가 없어도(예: 5세) 나이는 증가시킴
                 event = get_next_event(chat_history['age'], chat_history['event_history'])
+                chat_history['age'] += 1
+                stage = get_stage_prompt(chat_history['age'])
                 if event:
-                    chat_history['age'] += 1
-                    stage = get_stage_prompt(chat_history['age'])
                     event_message = f"{event['description']}"
                     memory.chat_memory.add_messages([SystemMessage(content=event_message)])
                     chat_history['event_history'].append(event['name'])
                     chat_history['history'].append(["system", event_message])
-                    age_message = f"이제 너는 {chat_history['age']}살이야. 현재 단계는 {stage}입니다."
-                    memory.chat_memory.add_messages([SystemMessage(content=age_message)])
-                    chat_history['history'].append(["system", age_message])
+                age_message = f"이제 너는 {chat_history['age']}살이야. 현재 단계는 {stage}입니다."
+                memory.chat_memory.add_messages([SystemMessage(content=age_message)])
+                chat_history['history'].append(["system", age_message])
 
         stage = get_stage_prompt(chat_history['age'])
 
-        formatted_prompt = chat_prompt.format_messages(
-            name=persona['name'],
-            age=chat_history['age'],
-            gender=persona['gender'],
-            role=persona['role'],
-            stage=stage,
-            personality=persona['personality'],
-            hobbies=persona['hobbies'],
-            speaking_style=persona['speaking_style'],
-            parent_role=persona['parent_role'],
-            text=message
-        )
-
-        memory.chat_memory.add_messages([SystemMessage(content=formatted_prompt[0].content)])
-        memory.chat_memory.add_messages([SystemMessage(content=formatted_prompt[1].content)])
-
-        completion = llm(messages=memory.chat_memory.messages)
-        if not isinstance(completion, AIMessage):
+        # 고정 시스템 프롬프트는 메모리에 다시 쌓지 않고 매 요청의 맨 앞에만 배치
+        with span('prompt_build'):
+            prompt = prompt_engine.build(
+                persona, stage, message,
+                context=f"현재 당신의 나이는 {chat_history['age']}세입니다.",
+                history_messages=memory.chat_memory.messages
+            )
+        observe_tokens('prompt', sum(count_tokens(prompt_message.content) for prompt_message in prompt))
+
+        with span('llm_chat', model=CHILD_MODEL):
+            completion = get_llm_pool().chat(prompt, model=CHILD_MODEL)
+        if not isinstance(completion, str):
             raise ValueError("Invalid completion response from OpenAI API. Completion: {}".format(completion))
 
-        chat_history['history'].append([message, completion.content])
-        memory.chat_memory.add_messages([SystemMessage(content=completion.content)])
+        observe_tokens('completion', count_tokens(completion))
+        chat_history['history'].append([message, completion])
+        memory.chat_memory.add_messages([HumanMessage(content=message), AIMessage(content=completion)])
 
         if chat_history['age'] >= 20:
             completion_message = "아이의 나이가 20세가 되어 대화가 종료됩니다. 평가를 위해 평가 버튼을 눌러주세요."
@@ -162,10 +176,12 @@ def counseling_bot_chat(message, persona, chat_history):
 
         return "", chat_history['history'], ""
     except Exception as e:
+        record_error('counseling_bot_chat', error=e)
         error_message = f"Error: {str(e)}\n{traceback.format_exc()}"
         return error_message, chat_history['history'], error_message
 
 def counseling_bot_undo(chat_history):
+    memory = get_memory()
     if len(chat_history['history']) > 1:
         chat_history['history'].pop()
         memory.chat_memory.messages.pop()
@@ -173,7 +189,7 @@ def counseling_bot_undo(chat_history):
     return chat_history['history']
 
 def counseling_bot_reset():
-    memory.clear()
+    get_memory().clear()
     return {'history': [], 'conversation_count': 0, 'age': 0, 'event_history': [], 'introduced': False, 'puberty_started': False, 'puberty_ended': False, 'puberty_age': random.randint(12, 16)}
 
 def create_persona(name, age, gender, personality, hobbies, speaking_style, parent_role):
@@ -191,58 +207,67 @@ def create_persona(name, age, gender, personality, hobbies, speaking_style, pare
     return persona
 
 def save_persona_to_file(persona):
-    try:
-        with open('shared_persona.txt', 'w', encoding='utf-8') as file:
-            for key, value in persona.items():
-                file.write(f"{key}: {value}\n")
-    except Exception as e:
-        print(f"페르소나 저장 중 오류 발생: {e}")
-
-def launch_app():
-    app2.launch()
+    # 마지막으로 설정한 페르소나를 대화 화면만 따로 실행할 때의 기본값으로 남겨 둠
+    # (메모리에만 반영하고 파일 쓰기는 백그라운드 작성기가 모아서 수행, 종료 시에는 persona_store가 flush)
+    with span('persona_save'):
+        persona_store.save('shared_persona.txt', persona)
 
-def set_persona(name, age, gender, personality, hobbies, speaking_style, parent_role):
+def set_persona(name, age, gender, personality, hobbies, speaking_style, parent_role, session):
+    # 페르소나는 이 세션의 상태로만 대화 탭에 넘기고, 새 페르소나로 대화를 새로 시작한 뒤 대화 탭으로 이동
     try:
         persona = create_persona(name, age, gender, personality, hobbies, speaking_style, parent_role)
-        persona_state.value = persona
         save_persona_to_file(persona)
-        threading.Thread(target=launch_app).start()
-        webbrowser.open("http://127.0.0.1:7861")
+        return (gr.Tabs(selected='chat'), persona) + tuple(reset_chat_session(session, persona))
     except Exception as e:
         error_message = f"Error: {str(e)}\n{traceback.format_exc()}"
-        return error_message
+        print(error_message)
+        return (gr.Tabs(), gr.update()) + tuple(gr.update() for _ in reset_outputs)
 
 with gr.Blocks(theme='snehilsanyal/scikit-learn') as app:
-    persona_state = gr.State()
     chat_history_state = gr.State(
         {'history': [], 'conversation_count': 0, 'age': 0, 'event_history': [], 'introduced': False, 'puberty_started': False, 'puberty_ended': False, 'puberty_age': random.randint(12, 16)})
  
 
     with gr.Tabs() as tabs:
-        with gr.Column():
-            gr.Markdown(
-                value="""
-                # <center>아이 페르소나 설정</center>
-                <center>자녀의 페르소나를 설정하고 아이와 대화를 시작하세요.</center>
-                """
-            )
-            with gr.Row():
-                with gr.Column():
-                    name = gr.Textbox(label = '', lines=1, placeholder="이름(닉네임)", scale=2)         
-                    personality = gr.Textbox(label = '',lines=1, placeholder="성격", scale=2)
-                    hobbies = gr.Textbox(label = '',lines=1, placeholder="취미", scale=2)
-                    speaking_style = gr.Textbox(label = '',lines=1, placeholder="말투", scale=2)
-                    style = gr.Textbox(label = '',lines=1, placeholder="외모", scale=2)
+        with gr.Tab("아이 페르소나 설정", id='persona'):
+            with gr.Column():
+                gr.Markdown(
+                    value="""
+                    # <center>아이 페르소나 설정</center>
+                    <center>자녀의 페르소나를 설정하고 아이와 대화를 시작하세요.</center>
+                    """
+                )
+                with gr.Row():
+                    with gr.Column():
+                        name = gr.Textbox(label = '', lines=1, placeholder="이름(닉네임)", scale=2)         
+                        personality = gr.Textbox(label = '',lines=1, placeholder="성격", scale=2)
+                        hobbies = gr.Textbox(label = '',lines=1, placeholder="취미", scale=2)
+                        speaking_style = gr.Textbox(label = '',lines=1, placeholder="말투", scale=2)
+                        style = gr.Textbox(label = '',lines=1, placeholder="외모", scale=2)
                     
-                    with gr.Row():
-                        age = gr.Slider(label="나이", minimum=5, maximum=15, step=1, value=8, scale=10)  # 나이를 8세에서 12세로 고정
-                    with gr.Row():
-                        with gr.Column():
-                            gender = gr.Radio(label = '자녀 성별',choices=["남성", "여성"], scale=1)
-                        with gr.Column():
-                            parent_role = gr.Radio(label = '사용자의 역할',choices=["엄마", "아빠"], scale=1)
-            gr.Button(value="페르소나 설정 완료", icon=r"img/free-icon-done-6543448.png").click(fn=set_persona, inputs=[
-                name, age, gender, personality, hobbies, speaking_style, parent_role
-            ], outputs=[])
-
-app.launch(server_port=7860)
+                        with gr.Row():
+                            age = gr.Slider(label="나이", minimum=5, maximum=15, step=1, value=8, scale=10)  # 나이를 8세에서 12세로 고정
+                        with gr.Row():
+                            with gr.Column():
+                                gender = gr.Radio(label = '자녀 성별',choices=["남성", "여성"], scale=1)
+                            with gr.Column():
+                                parent_role = gr.Radio(label = '사용자의 역할',choices=["엄마", "아빠"], scale=1)
+                gr.Button(value="페르소나 설정 완료", icon=r"img/free-icon-done-6543448.png").click(fn=set_persona, inputs=[
+                    name, age, gender, personality, hobbies, speaking_style, parent_role, session_state
+                ], outputs=[tabs, persona_state] + reset_outputs)
+
+        # 대화 화면도 같은 서버의 탭으로 제공
+        with gr.Tab("자녀와 대화", id='chat'):
+            app2.render()
+
+# 여러 세션의 요청을 한 프로세스에서 동시에 처리
+app.queue(default_concurrency_limit=CONCURRENCY_LIMIT)
+
+if __name__ == "__main__":
+    start_metrics_server()
+    app.launch(server_port=7860, prevent_thread_lock=True,
+               app_kwargs={'middleware': [cache_header_middleware()]})
+    # 화면이 뜬 뒤에 검색기와 이벤트 목록 등을 백그라운드에서 준비
+    report_first_page(app.local_url)
+    start_background_warmup()
+    app.block_thread()
@@ -0,0 +1,66 @@
+import time
+import importlib
+import threading
+import urllib.request
+
+from metrics import metrics, span
+
+# 진입 모듈이 가장 먼저 이 모듈을 불러오므로 프로세스 시작 시각으로 사용
+STARTED_AT = time.perf_counter()
+
+
+def _warm_event_catalog():
+    from event_catalog import get_catalog
+    get_catalog()
+
+
+def _warm_retriever():
+    # 대화 저장소, 벡터 색인/컬렉션, 임베딩 모델을 첫 평가 요청 전에 미리 열어 둠
+    from Chroma_consultant import get_retriever
+    from empathy_embedding import get_embedder
+    get_retriever()
+    get_embedder()
+
+
+def _warm_chat_runtime():
+    # 첫 대화에서 필요한 langchain 메모리, 토크나이저, LLM 클라이언트
+    from conversation_memory import count_tokens
+    from llm_client import get_llm_pool
+    importlib.import_module('langchain.memory')
+    count_tokens('')
+    get_llm_pool()
+
+
+WARMUP_TASKS = [
+    ('event_catalog', _warm_event_catalog),
+    ('chat_runtime', _warm_chat_runtime),
+    ('retriever', _warm_retriever),
+]
+
+
+def _run_warmup(tasks):
+    for name, task in tasks:
+        try:
+            with span(f'warmup_{name}'):
+                started = time.perf_counter()
+                task()
+            print(f"미리 준비 완료: {name} ({time.perf_counter() - started:.2f}초)")
+        except Exception as e:
+            # 준비에 실패해도 첫 사용 시점에 다시 시도하므로 서비스는 계속함
+            print(f"미리 준비 실패: {name}: {e}")
+
+
+def start_background_warmup(tasks=None):
+    thread = threading.Thread(target=_run_warmup, args=(tasks or WARMUP_TASKS,), name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def report_first_page(url):
+    # 프로세스 시작부터 첫 페이지를 실제로 받아 올 때까지 걸린 시간
+    with urllib.request.urlopen(url, timeout=30) as response:
+        response.read()
+    elapsed = time.perf_counter() - STARTED_AT
+    metrics.observe('startup_seconds', elapsed, stage='first_page')
+    print(f"첫 페이지 준비까지 {elapsed:.2f}초")
+    return elapsed
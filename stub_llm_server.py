@@ -0,0 +1,162 @@
+import sys
+import json
+import asyncio
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_client import AsyncLLMClient, LLMError
+
+STUB_REPLY = "안녕하세요 엄마 😊"
+
+# 요청마다 하나씩 꺼내 쓰는 응답 방식 (비어 있으면 'ok')
+# ok: 정상 응답, retry: 429 + Retry-After, error: 400, bad_json: 해석할 수 없는 본문,
+# bad_chunk: 첫 스트리밍 조각이 깨짐, cut_stream: 몇 조각을 보낸 뒤 깨진 조각
+FAULTS = ('ok', 'retry', 'error', 'bad_json', 'bad_chunk', 'cut_stream')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        fault = self.server.next_fault()
+        if fault == 'retry':
+            self._send(429, b'{"error": "rate limited"}', headers={'Retry-After': '0'})
+        elif fault == 'error':
+            self._send(400, b'{"error": "bad request"}')
+        elif body.get('stream'):
+            self._stream(fault)
+        elif fault == 'bad_json':
+            self._send(200, b'{"choices": [')
+        else:
+            self._send(200, json.dumps({'choices': [{'message': {'content': STUB_REPLY}}]}).encode('utf-8'))
+
+    def _send(self, status, data, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, fault):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        chunks = [json.dumps({'choices': [{'delta': {'content': ch}}]}) for ch in STUB_REPLY]
+        if fault == 'bad_chunk':
+            chunks.insert(0, '{"choices": [')
+        elif fault == 'cut_stream':
+            chunks.insert(3, '{"choices": [')
+        for chunk in chunks:
+            self.wfile.write(f"data: {chunk}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    # OpenAI 호환 /chat/completions 스텁 서버 (OPENAI_BASE_URL을 이 서버로 바꿔 클라이언트를 시험)
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.faults = deque()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def next_fault(self):
+        with self._lock:
+            self.requests += 1
+            return self.faults.popleft() if self.faults else 'ok'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='stub-llm', daemon=True).start()
+        return self
+
+
+async def _collect(client, stream):
+    if stream:
+        return ''.join([content async for content in client.stream([{'role': 'user', 'content': '안녕'}])])
+    return await client.chat([{'role': 'user', 'content': '안녕'}])
+
+
+# (이름, 스트리밍 여부, 응답 방식 목록, 기대 결과, 기대 요청 수)
+CHECKS = [
+    ('chat 정상', False, [], STUB_REPLY, 1),
+    ('chat 429 후 재시도', False, ['retry'], STUB_REPLY, 2),
+    ('chat 깨진 본문 후 재시도', False, ['bad_json'], STUB_REPLY, 2),
+    ('chat 깨진 본문 반복', False, ['bad_json'] * 3, LLMError, 3),
+    ('chat 400은 재시도하지 않음', False, ['error'], LLMError, 1),
+    ('stream 정상', True, [], STUB_REPLY, 1),
+    ('stream 429 후 재시도', True, ['retry'], STUB_REPLY, 2),
+    ('stream 첫 조각이 깨지면 재시도', True, ['bad_chunk'], STUB_REPLY, 2),
+    ('stream 중간 조각이 깨지면 중단', True, ['cut_stream'], LLMError, 1),
+]
+
+
+async def _run_check(server, stream, faults, max_retries):
+    server.faults = deque(faults)
+    server.requests = 0
+    client = AsyncLLMClient(base_url=server.base_url, api_key='stub', rate=1000, burst=1000,
+                            timeout=5, max_retries=max_retries)
+    try:
+        return await _collect(client, stream)
+    except LLMError as e:
+        return e
+    finally:
+        await client.aclose()
+
+
+def run_checks(max_retries=2):
+    # 스텁 서버를 띄우고 재시도/중단 동작을 확인. 실패한 항목 수를 돌려줌
+    server = StubLLMServer().start()
+    failures = 0
+    try:
+        for name, stream, faults, expected, requests in CHECKS:
+            result = asyncio.run(_run_check(server, stream, faults, max_retries))
+            if expected is LLMError:
+                ok = isinstance(result, LLMError)
+            else:
+                ok = result == expected
+            ok = ok and server.requests == requests
+            failures += not ok
+            print(f"{'통과' if ok else '실패'}  {name}: 요청 {server.requests}회, 결과 {result!r}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LLM 클라이언트를 시험하기 위한 OpenAI 호환 스텁 서버')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--check', action='store_true', help='서버를 띄워 클라이언트의 재시도/오류 처리를 확인하고 종료')
+    parser.add_argument('--faults', default='',
+                        help=f"서버 모드에서 앞쪽 요청에 차례로 적용할 응답 방식 (쉼표 구분: {', '.join(FAULTS)})")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = run_checks()
+        print(f"{len(CHECKS) - failures}/{len(CHECKS)}개 통과")
+        return 1 if failures else 0
+
+    server = StubLLMServer(args.port)
+    server.faults.extend(fault for fault in args.faults.split(',') if fault)
+    print(f"스텁 서버 실행 중: OPENAI_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())